@@ -1,19 +1,2649 @@
+import array
+import bisect
+import collections
+import concurrent.futures
+import ctypes
+import ctypes.util
+import fnmatch
+import hashlib
 import io
+import itertools
 import json
+import mmap
+import multiprocessing
 import os
+import pathlib
+import queue
 import re
+import select
 import shutil
+import sqlite3
+import stat
+import struct
+import sys
+import threading
+import time
 import tkinter as tk
+import xml.etree.ElementTree as ET
+import zipfile
 from datetime import datetime
 from tkinter import filedialog, messagebox, simpledialog, ttk
 from tkinter.scrolledtext import ScrolledText
 
 from docx import Document
-from PIL import Image, ImageTk
+from PIL import Image, ImageTk, PngImagePlugin
+
+COLUMNS = ("Name", "Type", "Size", "Modified", "Question Available")
+# Extra column with the snippet of each content search hit, only displayed
+# while content search results are shown
+MATCH_COLUMN = "Match"
+
+# Background listing: rows are handed to the Treeview in batches so the
+# window stays responsive on very large folders
+LISTING_BATCH_SIZE = 200
+LISTING_BATCHES_PER_POLL = 5
+LISTING_POLL_MS = 30
+
+# Changes to the listed folder are picked up with inotify on Linux, or by
+# re-scanning it every few seconds elsewhere, and patched into the list
+WATCH_POLL_MS = 250
+WATCH_WAIT_SECONDS = 0.5
+WATCH_SCAN_SECONDS = 2
+
+# Search results and the "scanned N dirs" counter are posted at least this
+# often while the search walks the tree
+SEARCH_PROGRESS_SECONDS = 0.1
+# Search runs once typing has paused for this long; words shorter than
+# SEARCH_TYPED_MIN_CHARS match too much to search for on every pause, so
+# those wait for Enter
+SEARCH_DEBOUNCE_MS = 300
+SEARCH_TYPED_MIN_CHARS = 3
+# A content search typed within this long of the last one answers from the
+# index as it is instead of re-reading the folder's documents
+CONTENT_REFRESH_SECONDS = 30
+
+# Passage counts are computed in a process pool; rows show this until their
+# count arrives. None means one worker per CPU, 0 counts in-process.
+PENDING_COUNT = "…"
+COUNT_WORKERS = None
+COUNT_WAIT_SECONDS = 0.1
+# Counts are computed for the rows on screen plus this many rows either
+# side first; everything else is counted with at most one job per worker
+# in flight so newly scrolled-to rows never queue behind it
+COUNT_PREFETCH_ROWS = 40
+COUNT_JOBS_PER_WORKER = 2
+
+# Formats previewed and counted as plain UTF-8 text
+PLAIN_TEXT_EXTENSIONS = (
+    ".txt",
+    ".md",
+    ".py",
+    ".java",
+    ".html",
+    ".css",
+    ".js",
+    ".json",
+    ".xml",
+    ".csv",
+    ".log",
+)
+TEXT_CHUNK_SIZE = 1024 * 1024
+
+# Previews: documents are cut off at PREVIEW_TEXT_LIMIT characters, and
+# loaded previews are kept in an LRU cache of about PREVIEW_CACHE_BYTES
+PREVIEW_TEXT_LIMIT = 50000
+# Text files bigger than TEXT_WINDOW_BYTES are shown through mmap a window
+# at a time: chunks of up to TEXT_WINDOW_STEP bytes, cut at line ends, are
+# added as the view comes within TEXT_WINDOW_MARGIN of either end of the
+# window and dropped from the other end
+TEXT_WINDOW_BYTES = 256 * 1024
+TEXT_WINDOW_STEP = 64 * 1024
+TEXT_WINDOW_MARGIN = 0.2
+# Newlines are counted per block of this many bytes for jumping to a line
+LINE_INDEX_BLOCK = 1024 * 1024
+PREVIEW_CACHE_BYTES = 64 * 1024 * 1024
+PREVIEW_IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".bmp")
+# JPEGs are decoded at the smallest DCT scale at least this many times the
+# thumbnail size (Pillow's own default is 2); 1 still gives a sharp result
+THUMBNAIL_REDUCING_GAP = 1.0
+# Image thumbnails are also kept on disk in the freedesktop.org layout
+# (~/.cache/thumbnails/<flavour>/<md5 of URI>.png), which other programs
+# share. The thumbnails this app wrote (tagged THUMBNAIL_SOFTWARE) are
+# trimmed back to THUMBNAIL_CACHE_BYTES, least recently used first; other
+# programs' thumbnails are never removed.
+THUMBNAIL_FLAVOURS = (
+    ("normal", 128),
+    ("large", 256),
+    ("x-large", 512),
+    ("xx-large", 1024),
+)
+THUMBNAIL_CACHE_BYTES = 256 * 1024 * 1024
+THUMBNAIL_SOFTWARE = "Enhanced File Manager"
+PREVIEW_EXTENSIONS = PLAIN_TEXT_EXTENSIONS + (".docx",) + PREVIEW_IMAGE_EXTENSIONS
+# Previews not in the cache load in a worker thread; the UI checks for the
+# result this often
+PREVIEW_POLL_MS = 20
+# While idle, the worker preloads this many rows above and below the
+# selected one
+PREVIEW_PREFETCH_ROWS = 3
+# Passages listed by name in the preview's jump list; later ones can still
+# be reached by typing their number
+PASSAGE_LIST_LIMIT = 500
+
+# Grid view: cells hold a "normal" (128px) freedesktop thumbnail and a name.
+# Thumbnails are made by GRID_WORKERS threads for the cells on screen and
+# GRID_LOOKAHEAD_ROWS rows below them; up to GRID_CACHE_CELLS are kept
+GRID_CELL_SIZE = 128
+GRID_CELL_PADDING = 8
+GRID_LABEL_HEIGHT = 18
+GRID_WORKERS = min(os.cpu_count() or 1, 8)
+GRID_LOOKAHEAD_ROWS = 2
+GRID_CACHE_CELLS = 1000
+
+# Start of line, digits, then . or ,
+NUMBERED_PASSAGE_RE = re.compile(r"(?m)^\s*\d+[.,]")
+# Start of a line that could still turn into a numbered passage
+PARTIAL_PASSAGE_RE = re.compile(r"\s*\d*")
+# Byte-level version used on memory-mapped text files. It is confined to a
+# single line; ASCII lines are decided here, while a line whose leading
+# whitespace/digits contain a non-ASCII byte (e.g. Bengali digits or a
+# no-break space) is decoded and re-checked with NUMBERED_PASSAGE_RE.
+NUMBERED_PASSAGE_LINE_BYTES_RE = re.compile(
+    rb"[ \t\r\f\v\x1c-\x1f]*(?:[0-9]+[.,]|[0-9]*([\x80-\xff]))"
+)
+# Anchored on a literal newline rather than (?m)^ so re can skip from line
+# to line with a fast literal search; the first line is matched separately
+NUMBERED_PASSAGE_BYTES_RE = re.compile(b"\n" + NUMBERED_PASSAGE_LINE_BYTES_RE.pattern)
+
+# Bump whenever counting changes so stale cached counts are discarded
+PASSAGE_INDEX_VERSION = 3
+FILENAME_INDEX_VERSION = 1
+# Directories scanned between commits while the filename index is updated
+FILENAME_INDEX_COMMIT_EVERY = 200
+# Rows written per lock hold, so searches aren't held up by a huge folder
+FILENAME_INDEX_BATCH = 2000
+CONTENT_INDEX_VERSION = 1
+CONTENT_INDEX_COMMIT_EVERY = 50
+# Text kept per document; the rest of a huge file isn't searchable
+CONTENT_INDEX_MAX_CHARS = 4 * 1024 * 1024
+CONTENT_SEARCH_LIMIT = 500
+
+WORD_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+ODF_TEXT_NS = "{urn:oasis:names:tc:opendocument:xmlns:text:1.0}"
+
+# Text extractors keyed by lowercase extension. Each takes a path and yields
+# the document's text in chunks; formats without an extractor (.pdf, .doc)
+# have no passage count.
+TEXT_EXTRACTORS = {}
+
+
+def register_extractor(*extensions):
+    def decorator(func):
+        for ext in extensions:
+            TEXT_EXTRACTORS[ext] = func
+        return func
+
+    return decorator
+
+
+def extract_text_chunks(file_path):
+    ext = os.path.splitext(file_path)[1].lower()
+    extractor = TEXT_EXTRACTORS.get(ext)
+    if extractor is None:
+        return None
+    return extractor(file_path)
+
+
+def extract_document_text(file_path):
+    # The text of a document for the content index, cut off at
+    # CONTENT_INDEX_MAX_CHARS; None if it has no extractor or can't be read
+    chunks = extract_text_chunks(file_path)
+    if chunks is None:
+        return None
+    parts = []
+    budget = CONTENT_INDEX_MAX_CHARS
+    try:
+        for chunk in chunks:
+            parts.append(chunk[:budget])
+            budget -= len(parts[-1])
+            if budget <= 0:
+                break
+    except Exception:
+        return None
+    finally:
+        chunks.close()
+    return "".join(parts)
+
+
+@register_extractor(*PLAIN_TEXT_EXTENSIONS)
+def extract_plain_text(file_path):
+    with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+        while True:
+            chunk = f.read(TEXT_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+@register_extractor(".docx")
+def extract_docx_text(file_path):
+    # Paragraphs are joined with blank lines, as the preview shows them
+    count = 0
+    try:
+        for text in read_docx_paragraphs(file_path):
+            yield text if count == 0 else "\n\n" + text
+            count += 1
+        return
+    except (KeyError, ET.ParseError):
+        pass
+    # Let python-docx have a go, carrying on after the paragraphs already read
+    for text in [para.text for para in Document(file_path).paragraphs][count:]:
+        yield text if count == 0 else "\n\n" + text
+        count += 1
+
+
+def read_docx_paragraphs(file_path):
+    # Fast path: streams word/document.xml out of the zip instead of letting
+    # python-docx load the whole package, yielding each of the body's
+    # top-level paragraphs as soon as it has been parsed and then dropping
+    # it, so a reader that stops early never parses the rest. Mirrors
+    # python-docx's Paragraph.text.
+    with zipfile.ZipFile(file_path) as archive, archive.open("word/document.xml") as f:
+        body = None
+        depth = 0  # below body
+        for event, el in ET.iterparse(f, events=("start", "end")):
+            if event == "start":
+                if body is not None:
+                    depth += 1
+                elif el.tag == WORD_NS + "body":
+                    body = el
+            elif el is body:
+                return
+            elif body is not None:
+                depth -= 1
+                if depth == 0:
+                    if el.tag == WORD_NS + "p":
+                        yield docx_paragraph_text(el)
+                    # Done with it: the body only ever holds one child
+                    body.remove(el)
+
+
+def docx_paragraph_text(para):
+    parts = []
+    for child in para:
+        if child.tag == WORD_NS + "r":
+            runs = (child,)
+        elif child.tag == WORD_NS + "hyperlink":
+            runs = child.iterfind(WORD_NS + "r")
+        else:
+            continue
+        for run in runs:
+            for el in run:
+                tag = el.tag
+                if tag == WORD_NS + "t":
+                    parts.append(el.text or "")
+                elif tag in (WORD_NS + "tab", WORD_NS + "ptab"):
+                    parts.append("\t")
+                elif tag == WORD_NS + "cr":
+                    parts.append("\n")
+                elif tag == WORD_NS + "br":
+                    # Page and column breaks carry no text
+                    if el.get(WORD_NS + "type", "textWrapping") == "textWrapping":
+                        parts.append("\n")
+                elif tag == WORD_NS + "noBreakHyphen":
+                    parts.append("-")
+    return "".join(parts)
+
+
+@register_extractor(".odt")
+def extract_odt_text(file_path):
+    with zipfile.ZipFile(file_path) as archive:
+        root = ET.fromstring(archive.read("content.xml"))
+    first = True
+    for el in root.iter():
+        if el.tag in (ODF_TEXT_NS + "p", ODF_TEXT_NS + "h"):
+            text = "".join(el.itertext())
+            yield text if first else "\n" + text
+            first = False
+
+
+RTF_TOKEN_RE = re.compile(
+    r"\\(?:'([0-9a-fA-F]{2})|([a-zA-Z]+)(-?\d+)? ?|(.))|([{}])|([^\\{}]+)", re.S
+)
+RTF_SKIP_DESTINATIONS = {"fonttbl", "colortbl", "stylesheet", "info", "pict"}
+
+
+@register_extractor(".rtf")
+def extract_rtf_text(file_path):
+    # Minimal RTF reader: keeps the document text and paragraph breaks,
+    # drops control words and header destinations (font table, etc.).
+    # Unicode characters (\uN, a signed UTF-16 unit) are kept and the \ucN
+    # fallback characters that follow them for older readers skipped.
+    with open(file_path, "r", encoding="latin-1") as f:
+        data = f.read()
+
+    out = []
+    skip_depth = None
+    depth = 0
+    uc = 1
+    uc_stack = []
+    fallback = 0  # fallback characters still to skip
+    for hex_char, word, param, symbol, brace, text in RTF_TOKEN_RE.findall(data):
+        if brace == "{":
+            depth += 1
+            uc_stack.append(uc)
+        elif brace == "}":
+            if skip_depth is not None and depth <= skip_depth:
+                skip_depth = None
+            depth -= 1
+            if uc_stack:
+                uc = uc_stack.pop()
+            fallback = 0
+        elif skip_depth is not None:
+            continue
+        elif word == "uc" and param:
+            uc = int(param)
+        elif word == "u" and param:
+            out.append(chr(int(param) % 0x10000))
+            fallback = uc
+        elif fallback and (hex_char or symbol):
+            fallback -= 1
+        elif fallback and text:
+            text = text.replace("\r", "").replace("\n", "")
+            skipped = min(fallback, len(text))
+            fallback -= skipped
+            out.append(text[skipped:])
+        elif word:
+            fallback = 0
+            if word in RTF_SKIP_DESTINATIONS:
+                skip_depth = depth
+            elif word in ("par", "line"):
+                out.append("\n")
+            elif word == "tab":
+                out.append("\t")
+        elif symbol == "*":
+            skip_depth = depth
+        elif hex_char:
+            out.append(chr(int(hex_char, 16)))
+        elif symbol in ("\r", "\n"):
+            out.append("\n")
+        elif symbol in ("\\", "{", "}"):
+            out.append(symbol)
+        elif text:
+            out.append(text.replace("\r", "").replace("\n", ""))
+    # Characters outside the BMP come as a pair of \u surrogates
+    text = "".join(out)
+    yield text.encode("utf-16-le", "surrogatepass").decode("utf-16-le", "replace")
+
+
+def count_numbered_passages(text):
+    return sum(1 for _ in NUMBERED_PASSAGE_RE.finditer(text))
+
+
+def numbered_passage_offsets(text):
+    # Where each numbered passage's number ends, e.g. just after "37."
+    return array.array("q", (m.end() for m in NUMBERED_PASSAGE_RE.finditer(text)))
+
+
+def count_numbered_passages_stream(chunks, offsets=None):
+    # Same result as count_numbered_passages("".join(chunks)), but only one
+    # chunk plus the still-undecided start of the current line is ever held
+    # in memory, and matches are counted without being collected. If given,
+    # offsets gets the numbered_passage_offsets() of the joined text.
+    count = 0
+    carry = ""
+    skip_line = False  # the current line has already been decided
+    position = 0  # of the end of the text read so far
+    for chunk in chunks:
+        position += len(chunk)
+        if skip_line:
+            newline = chunk.find("\n")
+            if newline < 0:
+                continue
+            chunk = chunk[newline + 1 :]
+            skip_line = False
+
+        text = carry + chunk if carry else chunk
+        base = position - len(text)
+        cut = text.rfind("\n") + 1
+        if offsets is None:
+            count += sum(1 for _ in NUMBERED_PASSAGE_RE.finditer(text, 0, cut))
+        else:
+            for match in NUMBERED_PASSAGE_RE.finditer(text, 0, cut):
+                offsets.append(base + match.end())
+                count += 1
+
+        # The last line may continue in the next chunk
+        match = NUMBERED_PASSAGE_RE.match(text, cut)
+        if match:
+            if offsets is not None:
+                offsets.append(base + match.end())
+            count += 1
+            carry = ""
+            skip_line = True
+        elif PARTIAL_PASSAGE_RE.fullmatch(text, cut):
+            carry = text[cut:]
+        else:
+            carry = ""
+            skip_line = True
+    return count
+
+
+def count_numbered_passages_mmap(file_path, offsets=None):
+    # Runs the bytes regex straight over a read-only mapping of the file:
+    # no UTF-8 decoding and no copies, except for the rare non-ASCII line.
+    # If given, offsets gets the byte offset where each passage's number ends.
+    with open(file_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            count = 0
+            first = NUMBERED_PASSAGE_LINE_BYTES_RE.match(mapped)
+            matches = NUMBERED_PASSAGE_BYTES_RE.finditer(mapped)
+            for match in itertools.chain([first] if first else [], matches):
+                if match.start(1) < 0:
+                    count += 1
+                    if offsets is not None:
+                        offsets.append(match.end())
+                    continue
+                # A leading newline doesn't change the str regex's verdict
+                line_end = mapped.find(b"\n", match.end())
+                if line_end < 0:
+                    line_end = len(mapped)
+                line = mapped[match.start() : line_end].decode("utf-8", "ignore")
+                if NUMBERED_PASSAGE_RE.match(line):
+                    count += 1
+                    if offsets is not None:
+                        offsets.append(match.end())
+            return count
+
+
+def find_file_passages(file_path):
+    # Returns (count, offsets): the number of numbered passages and where
+    # each passage's number ends, in bytes for plain text files and in
+    # characters of the extracted text for documents. ("N/A", None) when the
+    # format has no text extractor or the file can't be read.
+    offsets = array.array("q")
+    try:
+        if os.path.splitext(file_path)[1].lower() in PLAIN_TEXT_EXTENSIONS:
+            return count_numbered_passages_mmap(file_path, offsets), offsets
+        chunks = extract_text_chunks(file_path)
+        if chunks is None:
+            return "N/A", None
+        return count_numbered_passages_stream(chunks, offsets), offsets
+    except Exception:
+        return "N/A", None
+
+
+class PassageIndex:
+    # On-disk cache of "Question Available" counts keyed by (path, size,
+    # mtime_ns), so a file is only re-read after it has changed. Each count
+    # is stored with the offsets of its passages (see find_file_passages)
+    # as a packed array of 64-bit ints. The index is purely an
+    # optimisation: if the database can't be opened every lookup misses and
+    # counts are simply recomputed.
+    def __init__(self, db_path):
+        self.lock = threading.Lock()
+        try:
+            self.conn = sqlite3.connect(db_path, check_same_thread=False)
+            version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+            if version != PASSAGE_INDEX_VERSION:
+                self.conn.execute("DROP TABLE IF EXISTS passage_counts")
+                self.conn.execute(f"PRAGMA user_version = {PASSAGE_INDEX_VERSION}")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS passage_counts ("
+                "path TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+                "mtime_ns INTEGER NOT NULL, count INTEGER NOT NULL, offsets BLOB)"
+            )
+            self.conn.commit()
+        except sqlite3.Error:
+            self.conn = None
 
+    def get_offsets(self, path, size, mtime_ns):
+        if self.conn is None:
+            return None
+        try:
+            with self.lock:
+                row = self.conn.execute(
+                    "SELECT offsets FROM passage_counts "
+                    "WHERE path = ? AND size = ? AND mtime_ns = ?",
+                    (os.path.abspath(path), size, mtime_ns),
+                ).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None or row[0] is None:
+            return None
+        offsets = array.array("q")
+        offsets.frombytes(row[0])
+        return offsets
+
+    def get(self, path, size, mtime_ns):
+        if self.conn is None:
+            return None
+        try:
+            with self.lock:
+                row = self.conn.execute(
+                    "SELECT count FROM passage_counts "
+                    "WHERE path = ? AND size = ? AND mtime_ns = ?",
+                    (os.path.abspath(path), size, mtime_ns),
+                ).fetchone()
+        except sqlite3.Error:
+            return None
+        return row[0] if row else None
+
+    def put_many(self, records):
+        # records: iterable of (path, size, mtime_ns, count, offsets), where
+        # offsets is an array("q") or None
+        if self.conn is None:
+            return
+        try:
+            with self.lock:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO passage_counts "
+                    "(path, size, mtime_ns, count, offsets) VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (
+                            os.path.abspath(path),
+                            size,
+                            mtime_ns,
+                            count,
+                            None if offsets is None else offsets.tobytes(),
+                        )
+                        for path, size, mtime_ns, count, offsets in records
+                    ],
+                )
+                self.conn.commit()
+        except sqlite3.Error:
+            pass
 
-class FileManagerApp:
+
+class FilenameIndex:
+    # On-disk index of every name under the indexed folders, so a search can
+    # be answered without walking the disk. Names are matched through an
+    # FTS5 trigram index where SQLite has one (queries of 3+ characters),
+    # otherwise with LIKE. Each directory's mtime is stored and only
+    # directories whose mtime changed are read again on update. Like
+    # PassageIndex, it degrades to an empty index on database errors.
+    def __init__(self, db_path):
+        self.lock = threading.Lock()
+        self.fts = False
+        # Copy of the roots table, replaced rather than changed so the UI
+        # thread can read it without the lock
+        self.roots = frozenset()
+        try:
+            self.conn = sqlite3.connect(db_path, check_same_thread=False)
+            version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+            if version != FILENAME_INDEX_VERSION:
+                for table in ("entry_names", "entries", "dirs", "roots"):
+                    self.conn.execute(f"DROP TABLE IF EXISTS {table}")
+                self.conn.execute(f"PRAGMA user_version = {FILENAME_INDEX_VERSION}")
+            self.conn.execute("PRAGMA journal_mode = WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "id INTEGER PRIMARY KEY, dir TEXT NOT NULL, name TEXT NOT NULL, "
+                "is_dir INTEGER NOT NULL, size INTEGER NOT NULL, "
+                "mtime_ns INTEGER NOT NULL)"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS entries_dir ON entries (dir, name)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS dirs ("
+                "path TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL)"
+            )
+            # Folders whose whole tree has been indexed at least once
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS roots (path TEXT PRIMARY KEY)"
+            )
+            try:
+                self.conn.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS entry_names USING fts5("
+                    "name, content='entries', content_rowid='id', "
+                    "tokenize='trigram')"
+                )
+                self.conn.execute(
+                    "CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT "
+                    "ON entries BEGIN INSERT INTO entry_names (rowid, name) "
+                    "VALUES (new.id, new.name); END"
+                )
+                self.conn.execute(
+                    "CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE "
+                    "ON entries BEGIN INSERT INTO entry_names "
+                    "(entry_names, rowid, name) VALUES ('delete', old.id, old.name); "
+                    "END"
+                )
+                self.fts = True
+            except sqlite3.OperationalError:
+                pass  # SQLite without FTS5 or its trigram tokenizer
+            self.conn.commit()
+            self.roots = frozenset(
+                row[0] for row in self.conn.execute("SELECT path FROM roots")
+            )
+        except sqlite3.Error:
+            self.conn = None
+
+    def covers(self, folder):
+        # True if folder lies in a tree that has been indexed. Called from
+        # the UI thread, so it never waits for the lock.
+        if self.conn is None:
+            return False
+        folder = os.path.normpath(os.path.abspath(folder))
+        return any(
+            folder == root or folder.startswith(root.rstrip(os.sep) + os.sep)
+            for root in self.roots
+        )
+
+    def search(self, folder, search_term):
+        # (path, is_dir, size, mtime_ns) of the entries below folder whose
+        # name may contain search_term (lowercase), in no particular order.
+        # The index folds case differently from str.lower() outside ASCII,
+        # so callers check the names again.
+        if self.conn is None:
+            return []
+        folder = os.path.normpath(os.path.abspath(folder))
+        prefix = folder.rstrip(os.sep) + os.sep
+        below = "(e.dir = ? OR (e.dir >= ? AND e.dir < ?))"
+        params = [folder, prefix, prefix[:-1] + chr(ord(os.sep) + 1)]
+        if self.fts and len(search_term) >= 3:
+            query = (
+                "SELECT e.dir, e.name, e.is_dir, e.size, e.mtime_ns "
+                "FROM entry_names JOIN entries e ON e.id = entry_names.rowid "
+                f"WHERE entry_names MATCH ? AND {below}"
+            )
+            params.insert(0, '"' + search_term.replace('"', '""') + '"')
+        else:
+            query = (
+                "SELECT e.dir, e.name, e.is_dir, e.size, e.mtime_ns FROM entries e "
+                f"WHERE e.name LIKE ? ESCAPE '\\' AND {below}"
+            )
+            pattern = re.sub(r"([\\%_])", r"\\\1", search_term)
+            params.insert(0, f"%{pattern}%")
+        try:
+            with self.lock:
+                rows = self.conn.execute(query, params).fetchall()
+        except sqlite3.Error:
+            return []
+        return [
+            (os.path.join(directory, name), is_dir, size, mtime_ns)
+            for directory, name, is_dir, size, mtime_ns in rows
+        ]
+
+    def update(self, folder):
+        # Brings the tree below folder up to date and marks it as indexed.
+        # Unchanged directories cost one stat; only those whose mtime moved
+        # are read again. Returns True if any entry changed.
+        if self.conn is None:
+            return False
+        folder = os.path.normpath(os.path.abspath(folder))
+        changed = False
+        pending = [folder]
+        scanned = 0
+        try:
+            while pending:
+                directory = pending.pop()
+                try:
+                    mtime_ns = os.stat(directory).st_mtime_ns
+                except OSError:
+                    continue
+
+                with self.lock:
+                    row = self.conn.execute(
+                        "SELECT mtime_ns FROM dirs WHERE path = ?", (directory,)
+                    ).fetchone()
+                    if row is not None and row[0] == mtime_ns:
+                        pending.extend(
+                            os.path.join(directory, name)
+                            for (name,) in self.conn.execute(
+                                "SELECT name FROM entries WHERE dir = ? AND is_dir = 1",
+                                (directory,),
+                            )
+                        )
+                        continue
+
+                try:
+                    current = self.scan(directory)
+                except OSError:
+                    continue
+                if self.store_directory(directory, mtime_ns, current):
+                    changed = True
+                scanned += 1
+                if scanned % FILENAME_INDEX_COMMIT_EVERY == 0:
+                    with self.lock:
+                        self.conn.commit()
+                pending.extend(
+                    os.path.join(directory, name)
+                    for name, (is_dir, _, _) in current.items()
+                    if is_dir
+                )
+
+            with self.lock:
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO roots (path) VALUES (?)", (folder,)
+                )
+                self.conn.commit()
+            self.roots = self.roots | {folder}
+        except sqlite3.Error:
+            return False
+        return changed
+
+    def scan(self, directory):
+        # name -> (is_dir, size, mtime_ns); symlinked folders aren't followed
+        entries = {}
+        with os.scandir(directory) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    is_dir = False
+                try:
+                    st = entry.stat()
+                    size = UNKNOWN if is_dir else st.st_size
+                    mtime_ns = st.st_mtime_ns
+                except OSError:
+                    size = mtime_ns = UNKNOWN
+                entries[entry.name] = (is_dir, size, mtime_ns)
+        return entries
+
+    def store_directory(self, directory, mtime_ns, current):
+        # Replaces the stored entries of directory with current, committing
+        # every FILENAME_INDEX_BATCH statements so the lock is only held
+        # briefly. The directory's mtime goes in last, so an interrupted
+        # update reads it again. Returns True if anything differed.
+        with self.lock:
+            stored = {
+                name: (entry_id, (bool(is_dir), size, entry_mtime))
+                for entry_id, name, is_dir, size, entry_mtime in self.conn.execute(
+                    "SELECT id, name, is_dir, size, mtime_ns FROM entries "
+                    "WHERE dir = ?",
+                    (directory,),
+                )
+            }
+        statements = []
+        for name, (entry_id, values) in stored.items():
+            if current.get(name) == values:
+                continue
+            statements.append(("DELETE FROM entries WHERE id = ?", (entry_id,)))
+            if values[0] and not current.get(name, (False,))[0]:
+                # A folder that's gone (or became a file) takes its tree along
+                path = os.path.join(directory, name)
+                prefix = path + os.sep
+                upper = path + chr(ord(os.sep) + 1)
+                statements.append(
+                    (
+                        "DELETE FROM entries WHERE dir = ? OR (dir >= ? AND dir < ?)",
+                        (path, prefix, upper),
+                    )
+                )
+                statements.append(
+                    (
+                        "DELETE FROM dirs WHERE path = ? OR (path >= ? AND path < ?)",
+                        (path, prefix, upper),
+                    )
+                )
+        for name, values in current.items():
+            stored_entry = stored.get(name)
+            if stored_entry is not None and stored_entry[1] == values:
+                continue
+            statements.append(
+                (
+                    "INSERT INTO entries (dir, name, is_dir, size, mtime_ns) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (directory, name) + values,
+                )
+            )
+        changed = bool(statements)
+        statements.append(
+            (
+                "INSERT OR REPLACE INTO dirs (path, mtime_ns) VALUES (?, ?)",
+                (directory, mtime_ns),
+            )
+        )
+        for start in range(0, len(statements), FILENAME_INDEX_BATCH):
+            with self.lock:
+                for sql, params in statements[start : start + FILENAME_INDEX_BATCH]:
+                    self.conn.execute(sql, params)
+                if len(statements) > FILENAME_INDEX_BATCH:
+                    self.conn.commit()
+        return changed
+
+
+class ContentIndex:
+    # Full-text index of the documents under the searched folders, built
+    # from the same extractors the preview uses. FTS5 keeps positional
+    # postings, so quoted phrases match exactly, and ranks hits with bm25.
+    # Documents are re-read only when their (size, mtime_ns) changed.
+    # Without FTS5 the index is unavailable.
+    def __init__(self, db_path):
+        self.lock = threading.Lock()
+        try:
+            self.conn = sqlite3.connect(db_path, check_same_thread=False)
+            version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+            if version != CONTENT_INDEX_VERSION:
+                for table in ("doc_text", "docs"):
+                    self.conn.execute(f"DROP TABLE IF EXISTS {table}")
+                self.conn.execute(f"PRAGMA user_version = {CONTENT_INDEX_VERSION}")
+            self.conn.execute("PRAGMA journal_mode = WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS docs ("
+                "id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, "
+                "size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL)"
+            )
+            self.conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS doc_text USING fts5(body)"
+            )
+            self.conn.commit()
+        except sqlite3.Error:
+            self.conn = None
+
+    @property
+    def available(self):
+        return self.conn is not None
+
+    def search(self, folder, query):
+        # (path, size, mtime_ns, snippet) of the best matching documents
+        # below folder, best first. Words must all appear; "quoted words"
+        # must appear as a phrase.
+        if self.conn is None:
+            return []
+        terms = [
+            phrase or word for phrase, word in re.findall(r'"([^"]*)"|(\S+)', query)
+        ]
+        match = " ".join('"' + term.replace('"', '""') + '"' for term in terms if term)
+        if not match:
+            return []
+        folder = os.path.normpath(os.path.abspath(folder))
+        prefix = folder.rstrip(os.sep) + os.sep
+        try:
+            with self.lock:
+                rows = self.conn.execute(
+                    "SELECT d.path, d.size, d.mtime_ns, "
+                    "snippet(doc_text, 0, '', '', '…', 16) "
+                    "FROM doc_text JOIN docs d ON d.id = doc_text.rowid "
+                    "WHERE doc_text MATCH ? AND d.path >= ? AND d.path < ? "
+                    "ORDER BY bm25(doc_text) LIMIT ?",
+                    (
+                        match,
+                        prefix,
+                        prefix[:-1] + chr(ord(os.sep) + 1),
+                        CONTENT_SEARCH_LIMIT,
+                    ),
+                ).fetchall()
+        except sqlite3.Error:
+            return []
+        return [
+            (path, size, mtime_ns, " ".join(snippet.split()))
+            for path, size, mtime_ns, snippet in rows
+        ]
+
+    def update(self, folder):
+        # Indexes new and changed documents below folder and drops the ones
+        # that are gone. Runs in the index worker thread. Returns True if
+        # anything changed.
+        if self.conn is None:
+            return False
+        folder = os.path.normpath(os.path.abspath(folder))
+        prefix = folder.rstrip(os.sep) + os.sep
+
+        found = {}
+        pending = [folder]
+        while pending:
+            directory = pending.pop()
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                pending.append(entry.path)
+                            elif (
+                                os.path.splitext(entry.name)[1].lower()
+                                in TEXT_EXTRACTORS
+                            ):
+                                st = entry.stat()
+                                found[entry.path] = (st.st_size, st.st_mtime_ns)
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+
+        try:
+            with self.lock:
+                stored = {
+                    path: (doc_id, (size, mtime_ns))
+                    for doc_id, path, size, mtime_ns in self.conn.execute(
+                        "SELECT id, path, size, mtime_ns FROM docs "
+                        "WHERE path >= ? AND path < ?",
+                        (prefix, prefix[:-1] + chr(ord(os.sep) + 1)),
+                    )
+                }
+                for path, (doc_id, _) in stored.items():
+                    if path not in found:
+                        self.conn.execute("DELETE FROM docs WHERE id = ?", (doc_id,))
+                        self.conn.execute(
+                            "DELETE FROM doc_text WHERE rowid = ?", (doc_id,)
+                        )
+                self.conn.commit()
+
+            changed = len(stored.keys() - found.keys()) > 0
+            stale = [
+                path
+                for path, stat_key in found.items()
+                if path not in stored or stored[path][1] != stat_key
+            ]
+            for n, path in enumerate(stale, 1):
+                # Unreadable documents are stored empty so they aren't
+                # retried until they change
+                text = extract_document_text(path) or ""
+                size, mtime_ns = found[path]
+                with self.lock:
+                    if path in stored:
+                        doc_id = stored[path][0]
+                        self.conn.execute(
+                            "UPDATE docs SET size = ?, mtime_ns = ? WHERE id = ?",
+                            (size, mtime_ns, doc_id),
+                        )
+                        self.conn.execute(
+                            "DELETE FROM doc_text WHERE rowid = ?", (doc_id,)
+                        )
+                    else:
+                        doc_id = self.conn.execute(
+                            "INSERT INTO docs (path, size, mtime_ns) VALUES (?, ?, ?)",
+                            (path, size, mtime_ns),
+                        ).lastrowid
+                    self.conn.execute(
+                        "INSERT INTO doc_text (rowid, body) VALUES (?, ?)",
+                        (doc_id, text),
+                    )
+                    if n % CONTENT_INDEX_COMMIT_EVERY == 0:
+                        self.conn.commit()
+                changed = True
+            with self.lock:
+                self.conn.commit()
+        except sqlite3.Error:
+            return False
+        return changed
+
+
+class InotifyWatcher:
+    # Reports the names of entries created, deleted, renamed or written in
+    # one directory. callback(names) is called from the watcher thread with
+    # a set of names, or with None when events were lost or the directory
+    # itself went away and it has to be listed again.
+    # IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+    # IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+    EVENTS = 0x2 | 0x4 | 0x8 | 0x40 | 0x80 | 0x100 | 0x200 | 0x400 | 0x800
+    # IN_DELETE_SELF | IN_MOVE_SELF | IN_Q_OVERFLOW | IN_IGNORED
+    RESCAN = 0x400 | 0x800 | 0x4000 | 0x8000
+    EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+    def __init__(self, path, callback):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), self.EVENTS) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, os.strerror(errno), path)
+        self.callback = callback
+        self.stopped = threading.Event()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        try:
+            while not self.stopped.is_set():
+                ready, _, _ = select.select([self.fd], [], [], WATCH_WAIT_SECONDS)
+                if not ready:
+                    continue
+                try:
+                    data = os.read(self.fd, 64 * 1024)
+                except BlockingIOError:
+                    continue
+
+                names = set()
+                offset = 0
+                while offset < len(data):
+                    _, mask, _, length = self.EVENT_HEADER.unpack_from(data, offset)
+                    offset += self.EVENT_HEADER.size
+                    if mask & self.RESCAN:
+                        names = None
+                        break
+                    # Events on the folder itself have no name
+                    if length:
+                        name = data[offset : offset + length].rstrip(b"\0")
+                        names.add(os.fsdecode(name))
+                    offset += length
+
+                if self.stopped.is_set():
+                    break
+                if names is None:
+                    self.callback(None)
+                    break
+                if names:
+                    self.callback(names)
+        finally:
+            os.close(self.fd)
+
+
+class PollingWatcher:
+    # Same as InotifyWatcher for platforms without it: re-scans the
+    # directory and reports the names whose type, size or mtime changed
+    def __init__(self, path, callback):
+        self.path = path
+        self.callback = callback
+        self.stopped = threading.Event()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def scan(self):
+        entries = {}
+        with os.scandir(self.path) as it:
+            for entry in it:
+                try:
+                    st = entry.stat()
+                    entries[entry.name] = (entry.is_dir(), st.st_size, st.st_mtime_ns)
+                except OSError:
+                    entries[entry.name] = ()
+        return entries
+
+    def run(self):
+        # A folder that can't be read to begin with has no listing to keep
+        # up to date either
+        try:
+            previous = self.scan()
+        except OSError:
+            return
+        while not self.stopped.wait(WATCH_SCAN_SECONDS):
+            try:
+                current = self.scan()
+            except OSError:
+                self.callback(None)
+                return
+            changed = {
+                name
+                for name in previous.keys() | current.keys()
+                if previous.get(name) != current.get(name)
+            }
+            previous = current
+            if changed and not self.stopped.is_set():
+                self.callback(changed)
+
+
+def watch_directory(path, callback):
+    # inotify where there is one; it can also fail when the per-user watch
+    # limit is used up
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(path, callback)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(path, callback)
+
+
+def file_type_category(file_path):
+    _, ext = os.path.splitext(file_path)
+    ext = ext.lower()
+
+    if ext in [".docx", ".doc", ".txt", ".pdf", ".rtf", ".odt", ".md"]:
+        return "Documents"
+    elif ext in [".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tiff", ".svg"]:
+        return "Images"
+    elif ext in [".mp4", ".avi", ".mov", ".mkv", ".flv", ".wmv"]:
+        return "Videos"
+    elif ext in [".mp3", ".wav", ".ogg", ".flac", ".aac"]:
+        return "Audio"
+    elif ext in [".zip", ".rar", ".7z", ".tar", ".gz"]:
+        return "Archives"
+    else:
+        return "Other"
+
+
+def format_file_size(size_bytes):
+    # Convert file size to a human-readable format
+    for unit in ["B", "KB", "MB", "GB", "TB"]:
+        if size_bytes < 1024:
+            return f"{size_bytes:.1f} {unit}"
+        size_bytes /= 1024
+    return f"{size_bytes:.1f} PB"
+
+
+def load_preview(file_path, box, cancelled=None, thumbnails=None):
+    # Reads a file and renders its preview without touching Tk, so the
+    # result can be cached and loaded off the UI thread. Returns (kind, data):
+    #   ("text", (content, passages, rest))
+    #   ("docx", (content, passages, rest))
+    #   ("image", (thumbnail, box))   ("unsupported", ext)   ("error", message)
+    # or None if cancelled() turned true part way through.
+    ext = os.path.splitext(file_path)[1].lower()
+
+    if ext in PLAIN_TEXT_EXTENSIONS:
+        # passages are the numbered_passage_offsets() of content. A big file
+        # only has its first chunk read here; rest is then (file_path,
+        # offset) for a TextWindow to carry on from, and passages is None as
+        # it would take a full scan
+        try:
+            with open(file_path, "rb") as f:
+                data = f.read(TEXT_WINDOW_BYTES + 1)
+            if len(data) <= TEXT_WINDOW_BYTES:
+                content = data.decode("utf-8", errors="replace")
+                return ("text", (content, numbered_passage_offsets(content), None))
+            end = text_chunk_end(data, 0, TEXT_WINDOW_STEP)
+            content = data[:end].decode("utf-8", errors="replace")
+            return ("text", (content, None, (file_path, end)))
+        except Exception as e:
+            return ("error", f"Error reading file: {e}")
+
+    elif ext == ".docx":
+        # Paragraphs are read only up to PREVIEW_TEXT_LIMIT, so a long
+        # document shows without being parsed to the end; passages then only
+        # covers the text shown, and rest is the file_path to read more from
+        # (None if it was read to the end)
+        try:
+            text = read_docx_preview(file_path, PREVIEW_TEXT_LIMIT, cancelled)
+            if text is None:
+                return None
+            content, truncated = text
+            passages = numbered_passage_offsets(content)
+            return ("docx", (content, passages, file_path if truncated else None))
+        except Exception as e:
+            return ("error", f"Error reading .docx file:\n{e}")
+
+    elif ext in PREVIEW_IMAGE_EXTENSIONS:
+        try:
+            if thumbnails is None:
+                return ("image", (make_thumbnail(file_path, box), box))
+            return ("image", (thumbnails.thumbnail(file_path, box), box))
+        except Exception as e:
+            return ("error", f"Error displaying image: {e}")
+
+    return ("unsupported", ext)
+
+
+def read_docx_preview(file_path, limit, cancelled=None):
+    # (text, truncated): the document's text cut off at limit characters,
+    # or None if cancelled() turned true part way through
+    parts = []
+    budget = limit
+    paragraphs = extract_docx_text(file_path)
+    try:
+        for paragraph in paragraphs:
+            if cancelled is not None and cancelled():
+                return None
+            parts.append(paragraph[:budget])
+            budget -= len(parts[-1])
+            if budget <= 0:
+                break
+    finally:
+        paragraphs.close()
+    return "".join(parts), budget <= 0
+
+
+def line_around(text, offset):
+    # The line of text that offset falls on, cut short for a list entry
+    start = text.rfind("\n", 0, offset) + 1
+    end = text.find("\n", offset)
+    line = text[start : end if end >= 0 else len(text)].strip()
+    return line if len(line) <= 60 else line[:59] + "…"
+
+
+def text_chunk_end(data, start, limit):
+    # End of a chunk of data starting at start: just past the last newline
+    # within limit bytes, or limit bytes on if the line is longer than that
+    stop = min(start + limit, len(data))
+    if stop == len(data):
+        return stop
+    newline = data.rfind(b"\n", start, stop)
+    return newline + 1 if newline >= 0 else stop
+
+
+def text_chunk_start(data, end, limit):
+    # Start of a chunk of data ending at end, the mirror of text_chunk_end
+    start = max(end - limit, 0)
+    if start == 0:
+        return 0
+    newline = data.find(b"\n", start - 1, end - 1)
+    return newline + 1 if newline >= 0 else start
+
+
+def make_thumbnail(file_path, box):
+    # Shrinks an image to fit box, decoding as little of it as possible: a
+    # JPEG's embedded EXIF thumbnail if it is big enough, otherwise the
+    # JPEG decoded straight at a reduced DCT scale (thumbnail() calls
+    # draft() with box * reducing_gap) and other formats reduced by whole
+    # factors before the final resample
+    with Image.open(file_path) as img:
+        if img.format == "JPEG":
+            thumbnail = exif_thumbnail(img, box)
+            if thumbnail is not None:
+                return thumbnail
+        img.thumbnail(box, reducing_gap=THUMBNAIL_REDUCING_GAP)
+        # Decoded now, while the file is open
+        img.load()
+        return img
+
+
+def exif_thumbnail(img, box):
+    # The EXIF thumbnail of an opened JPEG, shrunk to fit box, if it has
+    # the image's proportions and is at least as big as the result would be
+    data = read_exif_thumbnail(img.info.get("exif", b""))
+    if data is None:
+        return None
+    scale = min(box[0] / img.width, box[1] / img.height, 1)
+    try:
+        thumbnail = Image.open(io.BytesIO(data))
+        if (
+            thumbnail.width < int(img.width * scale)
+            or thumbnail.height < int(img.height * scale)
+            or abs(thumbnail.width / thumbnail.height - img.width / img.height) > 0.02
+        ):
+            return None
+        thumbnail.thumbnail(box)
+        thumbnail.load()
+    except Exception:
+        return None
+    return thumbnail
+
+
+def read_exif_thumbnail(exif):
+    # The JPEG bytes IFD1 of raw EXIF data points to, or None
+    if exif.startswith(b"Exif\0\0"):
+        exif = exif[6:]
+    if exif[:2] == b"II":
+        order = "<"
+    elif exif[:2] == b"MM":
+        order = ">"
+    else:
+        return None
+    try:
+        ifd0 = struct.unpack_from(order + "I", exif, 4)[0]
+        entries = struct.unpack_from(order + "H", exif, ifd0)[0]
+        ifd1 = struct.unpack_from(order + "I", exif, ifd0 + 2 + 12 * entries)[0]
+        if not ifd1:
+            return None
+        start = length = None
+        for k in range(struct.unpack_from(order + "H", exif, ifd1)[0]):
+            tag, _, _, value = struct.unpack_from(
+                order + "HHII", exif, ifd1 + 2 + 12 * k
+            )
+            if tag == 0x0201:  # JPEGInterchangeFormat
+                start = value
+            elif tag == 0x0202:  # JPEGInterchangeFormatLength
+                length = value
+    except struct.error:
+        return None
+    if not start or not length or start + length > len(exif):
+        return None
+    return exif[start : start + length]
+
+
+class ThumbnailStore:
+    # Persistent image thumbnails in the freedesktop.org thumbnail layout.
+    # A thumbnail is valid while the Thumb::MTime and Thumb::Size stored in
+    # it match the source file. Hits touch the thumbnail's mtime, which
+    # serves as the LRU clock when the cache is trimmed. Only thumbnails
+    # written by this app count towards the cap or get trimmed.
     def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+        self.owned = None  # path -> bytes of our thumbnails, once counted
+        self.total = 0
+
+    def thumbnail(self, file_path, box):
+        # Thumbnail of file_path fitted to box, from disk if possible
+        st = os.stat(file_path)
+        flavour, flavour_size = next(
+            (f for f in THUMBNAIL_FLAVOURS if f[1] >= max(box)), THUMBNAIL_FLAVOURS[-1]
+        )
+        uri = pathlib.Path(os.path.abspath(file_path)).as_uri()
+        path = os.path.join(
+            self.root, flavour, hashlib.md5(uri.encode()).hexdigest() + ".png"
+        )
+
+        img = self.load(path, st, box)
+        if img is not None:
+            return img
+        img = make_thumbnail(file_path, (flavour_size, flavour_size))
+        if img.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+            img = img.convert("RGB")
+        self.save(path, img, uri, st)
+        img.thumbnail(box)
+        return img
+
+    def load(self, path, st, box):
+        try:
+            with Image.open(path) as img:
+                if img.info.get("Thumb::MTime") != str(
+                    int(st.st_mtime)
+                ) or img.info.get("Thumb::Size") != str(st.st_size):
+                    return None
+                img.thumbnail(box)
+                img.load()
+            os.utime(path)
+        except Exception:
+            return None
+        return img
+
+    def save(self, path, img, uri, st):
+        info = PngImagePlugin.PngInfo()
+        info.add_text("Thumb::URI", uri)
+        info.add_text("Thumb::MTime", str(int(st.st_mtime)))
+        info.add_text("Thumb::Size", str(st.st_size))
+        info.add_text("Software", THUMBNAIL_SOFTWARE)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+            try:
+                replaced = os.path.getsize(path)
+            except OSError:
+                replaced = 0
+            img.save(temp_path, "PNG", pnginfo=info)
+            os.chmod(temp_path, 0o600)
+            os.replace(temp_path, path)
+            written = os.path.getsize(path)
+        except OSError:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return
+        self.account(path, written)
+
+    def account(self, path, size):
+        with self.lock:
+            if self.owned is None:
+                self.owned = dict(self.files())
+                self.total = sum(self.owned.values())
+            self.total += size - self.owned.get(path, 0)
+            self.owned[path] = size
+            if self.total <= THUMBNAIL_CACHE_BYTES:
+                return
+            # Trim to 90% so this doesn't run on every save
+            by_age = []
+            for owned_path in self.owned:
+                try:
+                    by_age.append((os.stat(owned_path).st_mtime, owned_path))
+                except OSError:
+                    by_age.append((0, owned_path))
+            for _, owned_path in sorted(by_age):
+                if self.total <= THUMBNAIL_CACHE_BYTES * 0.9:
+                    break
+                try:
+                    os.remove(owned_path)
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    continue
+                self.total -= self.owned.pop(owned_path)
+
+    def files(self):
+        # (path, size) of the thumbnails this app wrote, told apart from
+        # other programs' by their Software tag
+        for flavour, _ in THUMBNAIL_FLAVOURS:
+            try:
+                with os.scandir(os.path.join(self.root, flavour)) as entries:
+                    for entry in entries:
+                        try:
+                            size = entry.stat().st_size
+                            with Image.open(entry.path) as img:
+                                software = img.info.get("Software")
+                        except Exception:
+                            continue
+                        if software == THUMBNAIL_SOFTWARE:
+                            yield (entry.path, size)
+            except OSError:
+                continue
+
+
+def preview_size(preview):
+    # Rough number of bytes a loaded preview holds
+    kind, data = preview
+    if kind == "image":
+        thumbnail = data[0]
+        return thumbnail.width * thumbnail.height * len(thumbnail.getbands())
+    elif kind in ("text", "docx"):
+        return sys.getsizeof(data[0])
+    return 100
+
+
+def preview_fits(preview, box):
+    # An image thumbnail is only reused at the size it was made for
+    return preview[0] != "image" or preview[1][1] == box
+
+
+class PreviewCache:
+    # LRU cache of loaded previews keyed by (path, size, mtime_ns), so a
+    # changed file is never served stale. Entries are evicted oldest first
+    # once their estimated size passes max_bytes.
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total = 0
+        self.entries = collections.OrderedDict()  # key -> (preview, nbytes)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, preview):
+        nbytes = preview_size(preview)
+        if nbytes > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.total -= old[1]
+            self.entries[key] = (preview, nbytes)
+            self.total += nbytes
+            while self.total > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.total -= evicted
+
+
+class PreviewLoader:
+    # Loads previews into a PreviewCache in a worker thread. Only the latest
+    # request matters: a new one replaces any request not yet started, and
+    # a load in progress is abandoned at its next checkpoint. Results are
+    # posted to results as (serial, tag, preview) for the UI to pick up.
+    # With no request waiting, the worker prefetches likely next previews
+    # into the cache, giving way as soon as a request comes in.
+    def __init__(self, cache, thumbnails=None):
+        self.cache = cache
+        self.thumbnails = thumbnails
+        self.condition = threading.Condition()
+        self.request = None
+        self.serial = 0
+        self.results = queue.Queue()
+        self.prefetch_paths = collections.deque()
+        self.prefetch_box = None
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def submit(self, key, file_path, box, tag):
+        with self.condition:
+            self.serial += 1
+            self.request = (self.serial, key, file_path, box, tag)
+            self.condition.notify()
+            return self.serial
+
+    def cancel(self):
+        with self.condition:
+            self.serial += 1
+            self.request = None
+
+    def prefetch(self, paths, box):
+        # Replaces the previous list of paths to prefetch
+        with self.condition:
+            self.prefetch_paths = collections.deque(paths)
+            self.prefetch_box = box
+            self.condition.notify()
+
+    def is_latest(self, serial):
+        return serial == self.serial
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.request is None and not self.prefetch_paths:
+                    self.condition.wait()
+                request = self.request
+                self.request = None
+                if request is None:
+                    prefetch_path = self.prefetch_paths.popleft()
+                    prefetch_box = self.prefetch_box
+
+            if request is None:
+                self.prefetch_one(prefetch_path, prefetch_box)
+                continue
+
+            serial, key, file_path, box, tag = request
+            try:
+                preview = load_preview(
+                    file_path,
+                    box,
+                    lambda: not self.is_latest(serial),
+                    self.thumbnails,
+                )
+            except Exception as e:
+                preview = ("error", f"Error loading preview: {e}")
+            if preview is None:
+                continue
+            # Worth keeping even if the user has moved on
+            if key is not None and preview[0] != "error":
+                self.cache.put(key, preview)
+            if self.is_latest(serial):
+                self.results.put((serial, tag, preview))
+
+    def prefetch_one(self, file_path, box):
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return
+        key = (file_path, st.st_size, st.st_mtime_ns)
+        cached = self.cache.get(key)
+        if cached is not None and preview_fits(cached, box):
+            return
+        try:
+            preview = load_preview(
+                file_path, box, lambda: self.request is not None, self.thumbnails
+            )
+        except Exception:
+            return
+        if preview is not None and preview[0] != "error":
+            self.cache.put(key, preview)
+
+
+# Sentinels kept in RowStore's typed arrays
+UNKNOWN = -(1 << 63)  # size or mtime that couldn't be read
+COUNT_PENDING = -1
+COUNT_NA = -2  # file without a passage count
+COUNT_NONE = -3  # folders
+COUNT_BLANK = -4  # search results
+COUNT_LABELS = {
+    COUNT_PENDING: PENDING_COUNT,
+    COUNT_NA: "N/A",
+    COUNT_NONE: "-",
+    COUNT_BLANK: "",
+}
+
+KIND_FOLDER = 0
+KIND_FILE = 1
+KIND_PARENT = 2  # the "..." row
+KIND_REMOVED = 3  # deleted since it was listed, see RowStore.remove
+KIND_LABELS = ("Folder", "File", "Folder", "-")
+
+# Stored per row so filtering never has to look at names again
+CATEGORIES = ("Folder", "Documents", "Images", "Videos", "Audio", "Archives", "Other")
+CATEGORY_CODES = {category: code for code, category in enumerate(CATEGORIES)}
+
+
+def listing_record(name, path, is_file, st):
+    # The RowStore.append arguments for a directory entry; st is None if it
+    # couldn't be stat'ed. Documents are counted later.
+    if st is None:
+        size = mtime_ns = UNKNOWN
+    else:
+        size = st.st_size if is_file else UNKNOWN
+        mtime_ns = st.st_mtime_ns
+
+    if not is_file:
+        count = COUNT_NONE
+    elif file_type_category(name) == "Documents":
+        count = COUNT_PENDING
+    else:
+        count = COUNT_NA
+
+    return (name, path, KIND_FILE if is_file else KIND_FOLDER, size, mtime_ns, count)
+
+
+class SearchQuery:
+    # A search box query compiled into tests. Terms are ANDed:
+    #   word            name contains word ("quotes" keep spaces)
+    #   *.doc?          glob on the whole name
+    #   /regex/         regular expression searched in the name
+    #   ext:pdf,docx    type:folder, type:file or type:images etc.
+    #   size>10MB       modified<2024-01-31   modified>7d   questions>=5
+    # All matching ignores case. The tests are grouped by what they need,
+    # cheapest first: the name alone, then whether it is a folder, then
+    # size and mtime, then the passage count.
+    FIELD_RE = re.compile(r"(size|modified|questions)(>=|<=|>|<|=)(.+)$")
+    SIZE_RE = re.compile(r"([\d.]+)\s*([kmgt]?)b?$")
+    AGE_RE = re.compile(r"(\d+)([hdwy])$")
+    AGE_SECONDS = {"h": 3600, "d": 86400, "w": 7 * 86400, "y": 365 * 86400}
+    OPERATORS = {
+        ">=": lambda a, b: a >= b,
+        "<=": lambda a, b: a <= b,
+        ">": lambda a, b: a > b,
+        "<": lambda a, b: a < b,
+        "=": lambda a, b: a == b,
+    }
+
+    def __init__(self, text):
+        # Raises ValueError for a term that can't be understood
+        self.text = text
+        self.terms = [
+            quoted or bare for quoted, bare in re.findall(r'"([^"]*)"|(\S+)', text)
+        ]
+        self.substrings = []
+        self.name_tests = []
+        self.want_folder = None  # True, False or None for either
+        self.stat_tests = []
+        self.count_tests = []
+        for term in self.terms:
+            self.add_term(term)
+
+    def add_term(self, term):
+        lowered = term.lower()
+        field = self.FIELD_RE.match(lowered)
+        if lowered.startswith("ext:"):
+            extensions = {
+                "." + ext.lstrip(".") for ext in lowered[4:].split(",") if ext
+            }
+            self.name_tests.append(lambda name: os.path.splitext(name)[1] in extensions)
+        elif lowered.startswith("type:"):
+            kind = lowered[5:]
+            if kind in ("folder", "folders", "dir"):
+                self.want_folder = True
+            elif kind == "file":
+                self.want_folder = False
+            else:
+                category = next((c for c in CATEGORIES[1:] if c.lower() == kind), None)
+                if category is None:
+                    raise ValueError(f"Unknown type '{kind}'")
+                self.want_folder = False
+                self.name_tests.append(
+                    lambda name: file_type_category(name) == category
+                )
+        elif field:
+            name, op, value = field.groups()
+            compare = self.OPERATORS[op]
+            if name == "size":
+                size = self.parse_size(value)
+                self.stat_tests.append(
+                    lambda st_size, mtime_ns: st_size != UNKNOWN
+                    and compare(st_size, size)
+                )
+            elif name == "modified":
+                when = self.parse_time(value)
+                self.stat_tests.append(
+                    lambda st_size, mtime_ns: mtime_ns != UNKNOWN
+                    and compare(mtime_ns, when)
+                )
+            else:
+                if not value.isdigit():
+                    raise ValueError(f"questions needs a number, not '{value}'")
+                number = int(value)
+                self.count_tests.append(
+                    lambda count: isinstance(count, int) and compare(count, number)
+                )
+        elif len(term) > 2 and term.startswith("/") and term.endswith("/"):
+            try:
+                pattern = re.compile(term[1:-1], re.IGNORECASE)
+            except re.error as e:
+                raise ValueError(f"Bad regular expression: {e}")
+            self.name_tests.append(lambda name: pattern.search(name) is not None)
+        elif any(c in term for c in "*?["):
+            pattern = re.compile(fnmatch.translate(lowered))
+            self.name_tests.append(lambda name: pattern.match(name) is not None)
+        else:
+            self.substrings.append(lowered)
+
+    def parse_size(self, value):
+        match = self.SIZE_RE.match(value)
+        if not match:
+            raise ValueError(f"Bad size '{value}'")
+        number, unit = match.groups()
+        try:
+            return int(float(number) * 1024 ** " kmgt".index(unit or " "))
+        except ValueError:
+            raise ValueError(f"Bad size '{value}'")
+
+    def parse_time(self, value):
+        # A date, or an age like 7d meaning that long ago; in st_mtime_ns
+        match = self.AGE_RE.match(value)
+        if match:
+            seconds = int(match.group(1)) * self.AGE_SECONDS[match.group(2)]
+            return int((time.time() - seconds) * 1e9)
+        for fmt in ("%Y-%m-%d", "%Y-%m-%dt%H:%M"):
+            try:
+                return int(datetime.strptime(value, fmt).timestamp() * 1e9)
+            except ValueError:
+                pass
+        raise ValueError(f"Bad date '{value}', use YYYY-MM-DD or an age like 7d")
+
+    @property
+    def literal(self):
+        # Longest plain substring; every match contains it
+        return max(self.substrings, key=len, default="")
+
+    def match_name(self, name):
+        name = name.lower()
+        return all(s in name for s in self.substrings) and all(
+            test(name) for test in self.name_tests
+        )
+
+    def match_kind(self, is_folder):
+        return self.want_folder is None or self.want_folder == is_folder
+
+    def match_stat(self, size, mtime_ns):
+        return all(test(size, mtime_ns) for test in self.stat_tests)
+
+    def match_count(self, count):
+        return all(test(count) for test in self.count_tests)
+
+    def match_row(self, name, is_folder, size, mtime_ns):
+        # Everything but the passage count, from data already at hand
+        return (
+            self.match_name(name)
+            and self.match_kind(is_folder)
+            and self.match_stat(size, mtime_ns)
+        )
+
+    def narrows(self, previous):
+        # True if every match of this query is also a match of previous:
+        # each of its terms is still here, or a plain word got longer
+        return all(
+            term in self.terms
+            or (
+                term.lower() in previous.substrings
+                and any(term.lower() in s for s in self.substrings)
+            )
+            for term in previous.terms
+        )
+
+
+class RowStore:
+    # Rows of the file list in columnar form. Sizes, mtimes and counts are
+    # kept raw in typed arrays and only formatted when a row is drawn, so
+    # sorting compares numbers instead of display strings. Rows are
+    # addressed by their index; views hold arrays of indices.
+    def __init__(self):
+        self.names = []
+        self.paths = []
+        self.kinds = bytearray()
+        self.categories = bytearray()
+        self.sizes = array.array("q")
+        self.mtimes = array.array("q")  # st_mtime_ns
+        self.counts = array.array("q")
+        self.removed = 0
+        self.snippets = {}  # index -> text, for content search hits
+        # Rows whose size and mtime came from the filename index and may be
+        # stale; they are stat'ed when they come on screen
+        self.unchecked = set()
+
+    def __len__(self):
+        return len(self.names)
+
+    def append(self, name, path, kind, size, mtime_ns, count):
+        self.names.append(name)
+        self.paths.append(path)
+        self.kinds.append(kind)
+        self.categories.append(
+            CATEGORY_CODES[file_type_category(name)] if kind == KIND_FILE else 0
+        )
+        self.sizes.append(size)
+        self.mtimes.append(mtime_ns)
+        self.counts.append(count)
+        return len(self.names) - 1
+
+    def record(self, index):
+        # The arguments append() needs to copy this row into another store
+        return (
+            self.names[index],
+            self.paths[index],
+            self.kinds[index],
+            self.sizes[index],
+            self.mtimes[index],
+            self.counts[index],
+        )
+
+    def remove(self, index):
+        # Indices are never reused: removed rows stay behind as tombstones
+        # that filtered() leaves out
+        self.kinds[index] = KIND_REMOVED
+        self.categories[index] = len(CATEGORIES)
+        self.removed += 1
+
+    def set_count(self, index, count):
+        self.counts[index] = COUNT_NA if count == "N/A" else count
+
+    def values(self, index):
+        kind = self.kinds[index]
+        if kind == KIND_PARENT:
+            return ("...", "Folder", "-", "-", "-", "")
+
+        size = self.sizes[index]
+        if kind == KIND_FOLDER:
+            size_str = "-"
+        elif size == UNKNOWN:
+            size_str = "Unknown"
+        else:
+            size_str = format_file_size(size)
+
+        mtime_ns = self.mtimes[index]
+        if mtime_ns == UNKNOWN:
+            modified = "Unknown"
+        else:
+            modified = datetime.fromtimestamp(mtime_ns / 1e9).strftime(
+                "%Y-%m-%d %H:%M:%S"
+            )
+
+        count = self.counts[index]
+        return (
+            self.names[index],
+            KIND_LABELS[kind],
+            size_str,
+            modified,
+            COUNT_LABELS.get(count, count),
+            self.snippets.get(index, ""),
+        )
+
+    def sort_key(self, column):
+        if column == "Name":
+            return self.names.__getitem__
+        elif column == "Type":
+            return lambda index: KIND_LABELS[self.kinds[index]]
+        elif column == "Size":
+            return self.sizes.__getitem__
+        elif column == "Modified":
+            return self.mtimes.__getitem__
+        elif column == MATCH_COLUMN:
+            # Content search hits are stored best first
+            return int
+        else:
+            return self.counts.__getitem__
+
+    def filtered(self, indices, filter_category):
+        # filter_category is one of the filter dropdown's options
+        if filter_category == "All Files":
+            if not self.removed:
+                return list(indices)
+            kinds = self.kinds
+            return [i for i in indices if kinds[i] != KIND_REMOVED]
+        if filter_category == "Folders Only":
+            code = CATEGORY_CODES["Folder"]
+        else:
+            code = CATEGORY_CODES.get(filter_category, -1)
+        categories = self.categories
+        return [i for i in indices if categories[i] == code]
+
+    def sorted(self, indices, column, reverse=False):
+        return array.array(
+            "l", sorted(indices, key=self.sort_key(column), reverse=reverse)
+        )
+
+
+class VirtualTreeview:
+    # Keeps the rows of a ttk.Treeview in a plain Python list and only
+    # materialises the items that fit on screen, recycling them as the view
+    # scrolls. Selection, focus and scrolling are tracked by row index here
+    # rather than by Treeview item, so the widget holds at most a screenful
+    # of items whatever the number of rows.
+    def __init__(self, tree, scrollbar, values, on_select=None, on_scroll=None):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.values = values  # row -> tuple of column values
+        self.on_select = on_select
+        self.on_scroll = on_scroll
+
+        self.rows = []
+        self.top = 0
+        self.page_size = 20
+        self.row_height = 20
+        self.header_height = 25
+        self.item_ids = []  # recycled Treeview items, in display order
+        self.attached = 0
+
+        self.selection = set()
+        self.anchor = None
+        self.focus = None
+
+        self.scrollbar.configure(command=self.on_scrollbar)
+        self.tree.bind("<Configure>", lambda e: self.update_page_size())
+        self.tree.bind("<MouseWheel>", self.on_mousewheel)
+        self.tree.bind("<Button-4>", lambda e: self.scroll_by(-3))
+        self.tree.bind("<Button-5>", lambda e: self.scroll_by(3))
+        self.tree.bind("<Button-1>", lambda e: self.on_click(e, "set"))
+        self.tree.bind("<Control-Button-1>", lambda e: self.on_click(e, "toggle"))
+        self.tree.bind("<Shift-Button-1>", lambda e: self.on_click(e, "extend"))
+        for key, step in (
+            ("Up", -1),
+            ("Down", 1),
+            ("Prior", "page_up"),
+            ("Next", "page_down"),
+            ("Home", "home"),
+            ("End", "end"),
+        ):
+            self.tree.bind(f"<{key}>", lambda e, s=step: self.on_key(s, False))
+            self.tree.bind(f"<Shift-{key}>", lambda e, s=step: self.on_key(s, True))
+
+    # Rows
+
+    def set_rows(self, rows):
+        self.rows = rows
+        self.top = 0
+        self.selection = set()
+        self.anchor = self.focus = None
+        self.render()
+        self.notify_scroll()
+
+    def append_rows(self, rows):
+        start = len(self.rows)
+        self.rows.extend(rows)
+        # Only redraw if the new rows land inside the visible window
+        if start < self.top + self.page_size:
+            self.render()
+        else:
+            self.update_scrollbar()
+        self.notify_scroll()
+
+    def reorder(self, rows):
+        # The same rows in a new order: selection, anchor and focus stay on
+        # the same rows, and the focused row is kept in view
+        position = {row: i for i, row in enumerate(rows)}
+        self.selection = {position[self.rows[i]] for i in self.selection}
+        if self.anchor is not None:
+            self.anchor = position[self.rows[self.anchor]]
+        if self.focus is not None:
+            self.focus = position[self.rows[self.focus]]
+        self.rows = rows
+        if self.focus is not None:
+            self.see(self.focus)
+        self.render()
+        self.notify_scroll()
+
+    def insert_row(self, position, row):
+        self.rows.insert(position, row)
+        self.shift_positions(position, 1)
+        self.changed_at(position, 1)
+
+    def remove_row(self, position):
+        del self.rows[position]
+        self.selection.discard(position)
+        if self.anchor == position:
+            self.anchor = None
+        if self.focus == position:
+            self.focus = None
+        self.shift_positions(position, -1)
+        self.changed_at(position, -1)
+
+    def shift_positions(self, start, delta):
+        # Selection, anchor and focus follow their rows past an insert or
+        # removal at start
+        self.selection = {i + delta if i >= start else i for i in self.selection}
+        if self.anchor is not None and self.anchor >= start:
+            self.anchor += delta
+        if self.focus is not None and self.focus >= start:
+            self.focus += delta
+
+    def changed_at(self, position, delta):
+        # A change above the window scrolls with it so the rows on screen
+        # stay put; only a change inside the window needs a redraw
+        if position < self.top:
+            self.top = max(self.top + delta, 0)
+            self.update_scrollbar()
+        elif position < self.top + self.page_size:
+            self.top = max(min(self.top, len(self.rows) - self.page_size), 0)
+            self.render()
+        else:
+            self.update_scrollbar()
+        self.notify_scroll()
+
+    def clear(self):
+        self.set_rows(self.rows[:0])
+
+    def refresh(self):
+        # Redraws the values of the rows on screen
+        for k in range(self.attached):
+            self.tree.item(
+                self.item_ids[k], values=self.values(self.rows[self.top + k])
+            )
+
+    def visible_range(self):
+        return self.top, min(self.top + self.page_size, len(self.rows))
+
+    def selected_indices(self):
+        return sorted(self.selection)
+
+    # Rendering
+
+    def render(self):
+        needed = max(min(self.page_size, len(self.rows) - self.top), 0)
+        while len(self.item_ids) < needed:
+            item_id = self.tree.insert("", tk.END)
+            self.tree.detach(item_id)
+            self.item_ids.append(item_id)
+
+        for k in range(needed):
+            item_id = self.item_ids[k]
+            self.tree.item(item_id, values=self.values(self.rows[self.top + k]))
+            if k >= self.attached:
+                self.tree.move(item_id, "", k)
+        if self.attached > needed:
+            self.tree.detach(*self.item_ids[needed : self.attached])
+        self.attached = needed
+
+        window = range(self.top, self.top + needed)
+        self.tree.selection_set(
+            [self.item_ids[i - self.top] for i in self.selection if i in window]
+        )
+        if self.focus in window:
+            self.tree.focus(self.item_ids[self.focus - self.top])
+        self.update_scrollbar()
+
+    def update_scrollbar(self):
+        total = len(self.rows)
+        if total <= self.page_size:
+            self.scrollbar.set(0.0, 1.0)
+        else:
+            self.scrollbar.set(self.top / total, (self.top + self.page_size) / total)
+
+    def update_page_size(self):
+        if self.attached:
+            bbox = self.tree.bbox(self.item_ids[0])
+            if bbox:
+                self.header_height, self.row_height = bbox[1], bbox[3]
+        height = self.tree.winfo_height() - self.header_height
+        page_size = max(height // max(self.row_height, 1), 1)
+        if page_size != self.page_size:
+            self.page_size = page_size
+            self.scroll_to(self.top, force=True)
+
+    # Scrolling
+
+    def scroll_to(self, top, force=False):
+        top = max(min(top, len(self.rows) - self.page_size), 0)
+        if top != self.top or force:
+            self.top = top
+            self.render()
+            self.notify_scroll()
+
+    def scroll_by(self, rows):
+        self.scroll_to(self.top + rows)
+        return "break"
+
+    def see(self, index):
+        if index < self.top:
+            self.scroll_to(index)
+        elif index >= self.top + self.page_size:
+            self.scroll_to(index - self.page_size + 1)
+
+    def on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            self.scroll_to(int(float(amount) * len(self.rows)))
+        elif action == "scroll":
+            step = self.page_size if unit == "pages" else 1
+            self.scroll_by(int(amount) * step)
+
+    def on_mousewheel(self, event):
+        # Windows reports multiples of 120, macOS small deltas
+        notches = event.delta // 120 if abs(event.delta) >= 120 else event.delta
+        return self.scroll_by(-3 * notches)
+
+    def notify_scroll(self):
+        if self.on_scroll is not None:
+            self.on_scroll()
+
+    # Selection
+
+    def on_click(self, event, mode):
+        # Headings and column separators keep their default behaviour
+        if self.tree.identify_region(event.x, event.y) not in ("cell", "tree"):
+            return None
+        self.tree.focus_set()
+        item_id = self.tree.identify_row(event.y)
+        if item_id not in self.item_ids[: self.attached]:
+            return "break"
+
+        index = self.top + self.item_ids.index(item_id)
+        if mode == "toggle":
+            self.selection ^= {index}
+            self.anchor = index
+        elif mode == "extend" and self.anchor is not None:
+            low, high = sorted((self.anchor, index))
+            self.selection = set(range(low, high + 1))
+        else:
+            self.selection = {index}
+            self.anchor = index
+        self.focus = index
+        self.render()
+        self.notify_select()
+        return "break"
+
+    def on_key(self, step, extend):
+        if not self.rows:
+            return "break"
+        current = self.top if self.focus is None else self.focus
+        if step == "page_up":
+            index = current - self.page_size
+        elif step == "page_down":
+            index = current + self.page_size
+        elif step == "home":
+            index = 0
+        elif step == "end":
+            index = len(self.rows) - 1
+        else:
+            index = current + step
+        index = max(min(index, len(self.rows) - 1), 0)
+
+        if extend and self.anchor is not None:
+            low, high = sorted((self.anchor, index))
+            self.selection = set(range(low, high + 1))
+        else:
+            self.selection = {index}
+            self.anchor = index
+        self.focus = index
+        self.see(index)
+        self.render()
+        self.notify_select()
+        return "break"
+
+    def notify_select(self):
+        if self.on_select is not None:
+            self.on_select()
+
+
+class LineIndex:
+    # Finds the lines of a memory-mapped file without an offset per line:
+    # counts[k] is the number of newlines before byte k * LINE_INDEX_BLOCK,
+    # filled in only as far as a lookup has needed it
+    def __init__(self, data):
+        self.data = data
+        self.counts = array.array("q", [0])
+
+    def extend(self):
+        start = (len(self.counts) - 1) * LINE_INDEX_BLOCK
+        if start >= len(self.data):
+            return False
+        block = self.data[start : start + LINE_INDEX_BLOCK]
+        self.counts.append(self.counts[-1] + block.count(b"\n"))
+        return True
+
+    def line_offset(self, line):
+        # Byte offset of the start of a line (0-based), or None past the end
+        while self.counts[-1] < line:
+            if not self.extend():
+                return None
+        if line == 0:
+            return 0
+        # The block holding the newline that ends the previous line
+        k = bisect.bisect_left(self.counts, line) - 1
+        position = k * LINE_INDEX_BLOCK
+        for _ in range(line - self.counts[k]):
+            position = self.data.find(b"\n", position) + 1
+        return position
+
+
+class TextWindow:
+    # Shows a text file too big for the Text widget a window at a time. The
+    # file is memory-mapped and the widget holds at most about
+    # TEXT_WINDOW_BYTES of it, in chunks delimited by marks; chunks are read
+    # in as the view nears either end of the window and dropped from the
+    # other end. The scrollbar is taken over to stand for the whole file.
+    def __init__(self, text, path, header, content, end):
+        self.text = text
+        self.scrollbar = text.vbar
+        self.header = header  # shown before the start of the file
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.lines = LineIndex(self.data)
+        self.chunks = collections.deque()  # (start, end, mark), in order
+        self.marks = itertools.count()
+        self.extend_pending = False
+
+        self.text.configure(yscrollcommand=self.on_text_scroll)
+        self.scrollbar.configure(command=self.on_scrollbar)
+        self.text.delete(1.0, tk.END)
+        self.add_chunk(0, end, content)
+
+    def close(self):
+        self.text.configure(yscrollcommand=self.scrollbar.set)
+        self.scrollbar.configure(command=self.text.yview)
+        self.clear()
+        self.data.close()
+        self.file.close()
+
+    def clear(self):
+        for _, _, mark in self.chunks:
+            self.text.mark_unset(mark)
+        self.chunks.clear()
+        self.text.delete(1.0, tk.END)
+
+    # Chunks
+
+    def read(self, start, end):
+        text = self.data[start:end].decode("utf-8", errors="replace")
+        return self.header + text if start == 0 else text
+
+    def add_chunk(self, start, end, content=None, before=False):
+        mark = f"window{next(self.marks)}"
+        if content is None:
+            content = self.read(start, end)
+        elif start == 0:
+            content = self.header + content
+        if before:
+            # The old first chunk's mark has to end up after the new text
+            old_mark = self.chunks[0][2]
+            self.text.mark_gravity(old_mark, tk.RIGHT)
+            self.text.insert(1.0, content)
+            self.text.mark_gravity(old_mark, tk.LEFT)
+            self.text.mark_set(mark, 1.0)
+            self.text.mark_gravity(mark, tk.LEFT)
+            self.chunks.appendleft((start, end, mark))
+        else:
+            self.text.mark_set(mark, "end-1c")
+            self.text.mark_gravity(mark, tk.LEFT)
+            self.text.insert(tk.END, content)
+            self.chunks.append((start, end, mark))
+
+    def drop_chunk(self, first):
+        if first:
+            _, _, mark = self.chunks.popleft()
+            self.text.delete(mark, self.chunks[0][2])
+        else:
+            _, _, mark = self.chunks.pop()
+            self.text.delete(mark, "end-1c")
+        self.text.mark_unset(mark)
+
+    def window(self):
+        return self.chunks[0][0], self.chunks[-1][1]
+
+    def load_at(self, offset):
+        # Replaces the window with the chunk starting at the line that
+        # holds offset; the chunks around it follow as the view settles
+        newline = self.data.rfind(b"\n", max(offset - TEXT_WINDOW_STEP, 0), offset)
+        if newline >= 0 or offset <= TEXT_WINDOW_STEP:
+            start = newline + 1
+        else:
+            start = offset  # in the middle of a very long line
+        self.clear()
+        self.add_chunk(start, text_chunk_end(self.data, start, TEXT_WINDOW_STEP))
+        self.text.yview_moveto(0)
+        self.schedule_extend()
+
+    def line_text(self, offset):
+        # The line that the byte at offset is on, as for line_around
+        newline = self.data.rfind(b"\n", max(offset - 200, 0), offset)
+        start = newline + 1 if newline >= 0 else max(offset - 200, 0)
+        end = self.data.find(b"\n", offset, offset + 200)
+        line = self.data[start : end if end >= 0 else offset + 200]
+        return line_around(line.decode("utf-8", errors="replace"), 0)
+
+    def goto_line(self, line):
+        # line is 1-based; False if the file is shorter than that
+        offset = self.lines.line_offset(line - 1)
+        if offset is None or offset >= len(self.data):
+            return False
+        self.load_at(offset)
+        return True
+
+    # Scrolling
+
+    def schedule_extend(self):
+        if not self.extend_pending:
+            self.extend_pending = True
+            self.text.after_idle(self.extend)
+
+    def extend(self):
+        # Grows the window by a chunk towards whichever end the view is
+        # near, keeping the view where it is
+        self.extend_pending = False
+        if not self.chunks:
+            return
+        first, last = self.text.yview()
+        start, end = self.window()
+        if last > 1 - TEXT_WINDOW_MARGIN and end < len(self.data):
+            grow_down = True
+        elif first < TEXT_WINDOW_MARGIN and start > 0:
+            grow_down = False
+        else:
+            return
+
+        self.text.mark_set("window_view", "@0,0")
+        if grow_down:
+            self.add_chunk(end, text_chunk_end(self.data, end, TEXT_WINDOW_STEP))
+        else:
+            chunk_start = text_chunk_start(self.data, start, TEXT_WINDOW_STEP)
+            self.add_chunk(chunk_start, start, before=True)
+        while len(self.chunks) > 2:
+            start, end = self.window()
+            if end - start <= TEXT_WINDOW_BYTES:
+                break
+            self.drop_chunk(first=grow_down)
+        self.text.yview("window_view")
+        self.text.mark_unset("window_view")
+
+    def on_text_scroll(self, first, last):
+        # The widget's view of the window, turned into a view of the file
+        if not self.chunks:
+            return
+        start, end = self.window()
+        span = end - start
+        size = max(len(self.data), 1)
+        self.scrollbar.set(
+            (start + float(first) * span) / size, (start + float(last) * span) / size
+        )
+        start, end = self.window()
+        if (float(last) > 1 - TEXT_WINDOW_MARGIN and end < len(self.data)) or (
+            float(first) < TEXT_WINDOW_MARGIN and start > 0
+        ):
+            self.schedule_extend()
+
+    def on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            start, end = self.window()
+            offset = int(max(min(float(amount), 1.0), 0.0) * len(self.data))
+            if start <= offset < end:
+                self.text.yview_moveto((offset - start) / (end - start))
+            else:
+                self.load_at(min(offset, len(self.data) - 1))
+        elif action == "scroll":
+            self.text.yview_scroll(int(amount), unit)
+
+
+class ThumbnailGrid:
+    # Icon view of a VirtualTreeview's rows, drawn on a Canvas. The grid
+    # shares the list's rows, selection and focus, so filtering, sorting,
+    # previews and file operations work the same in either view; like the
+    # list it only draws the cells on screen. Thumbnails are made in a
+    # thread pool, since Pillow releases the GIL while decoding: the cells
+    # on screen are queued first, and queued work for cells that have
+    # scrolled away is cancelled before it starts.
+    def __init__(self, canvas, scrollbar, view, record, thumbnails, on_open=None):
+        self.canvas = canvas
+        self.scrollbar = scrollbar
+        self.view = view
+        self.record = record  # row -> RowStore.record() tuple
+        self.thumbnails = thumbnails
+        self.on_open = on_open
+
+        self.shown = False
+        self.top = 0  # first grid row on screen
+        self.columns = 1
+        self.page_rows = 1
+        self.render_pending = False
+
+        self.pool = None  # created on first use
+        self.pending = {}  # (path, size, mtime_ns) -> future
+        self.results = queue.Queue()
+        self.polling = False
+        self.photos = collections.OrderedDict()  # key -> PhotoImage or None
+
+        self.scrollbar.configure(command=self.on_scrollbar)
+        self.canvas.bind("<Configure>", lambda e: self.changed())
+        self.canvas.bind("<MouseWheel>", self.on_mousewheel)
+        self.canvas.bind("<Button-4>", lambda e: self.scroll_by(-1))
+        self.canvas.bind("<Button-5>", lambda e: self.scroll_by(1))
+        self.canvas.bind("<Button-1>", lambda e: self.on_click(e, "set"))
+        self.canvas.bind("<Control-Button-1>", lambda e: self.on_click(e, "toggle"))
+        self.canvas.bind("<Shift-Button-1>", lambda e: self.on_click(e, "extend"))
+        self.canvas.bind("<Double-1>", lambda e: self.open())
+        for key, step in (
+            ("Left", -1),
+            ("Right", 1),
+            ("Up", "up"),
+            ("Down", "down"),
+            ("Home", "home"),
+            ("End", "end"),
+        ):
+            self.canvas.bind(f"<{key}>", lambda e, s=step: self.on_key(s, False))
+            self.canvas.bind(f"<Shift-{key}>", lambda e, s=step: self.on_key(s, True))
+
+    def show(self):
+        self.shown = True
+        if self.view.focus is not None:
+            self.see(self.view.focus)
+        self.changed()
+
+    def hide(self):
+        self.shown = False
+        self.cancel_pending(set())
+
+    def close(self):
+        self.hide()
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+
+    def changed(self):
+        # Called whenever the list's rows change; redraws once things settle
+        if self.shown and not self.render_pending:
+            self.render_pending = True
+            self.canvas.after_idle(self.render)
+
+    # Layout
+
+    def cell_size(self):
+        width = GRID_CELL_SIZE + 2 * GRID_CELL_PADDING
+        return width, width + GRID_LABEL_HEIGHT
+
+    def total_rows(self):
+        return -(-len(self.view.rows) // self.columns)
+
+    def update_layout(self):
+        cell_width, cell_height = self.cell_size()
+        self.columns = max(self.canvas.winfo_width() // cell_width, 1)
+        self.page_rows = max(self.canvas.winfo_height() // cell_height, 1)
+        self.top = max(min(self.top, self.total_rows() - self.page_rows), 0)
+
+    def visible_positions(self):
+        # The last row may be partly on screen
+        first = self.top * self.columns
+        last = (self.top + self.page_rows + 1) * self.columns
+        return range(first, min(last, len(self.view.rows)))
+
+    # Rendering
+
+    def render(self):
+        self.render_pending = False
+        if not self.shown:
+            return
+        self.update_layout()
+        self.canvas.delete("all")
+        cell_width, cell_height = self.cell_size()
+        visible = self.visible_positions()
+        wanted = []
+        for position in visible:
+            row, column = divmod(position - visible.start, self.columns)
+            x = column * cell_width
+            y = row * cell_height
+            name, path, kind, size, mtime_ns, _ = self.record(self.view.rows[position])
+            key = (path, size, mtime_ns)
+
+            if position in self.view.selection:
+                self.canvas.create_rectangle(
+                    x + 2,
+                    y + 2,
+                    x + cell_width - 2,
+                    y + cell_height - 2,
+                    fill="#cce8ff",
+                    outline="#3399ff" if position == self.view.focus else "#cce8ff",
+                )
+            centre_x = x + cell_width // 2
+            centre_y = y + GRID_CELL_PADDING + GRID_CELL_SIZE // 2
+            photo = self.photos.get(key)
+            if photo is not None:
+                self.photos.move_to_end(key)
+                self.canvas.create_image(centre_x, centre_y, image=photo)
+            else:
+                if (
+                    kind == KIND_FILE
+                    and os.path.splitext(name)[1].lower() in PREVIEW_IMAGE_EXTENSIONS
+                    and key not in self.photos
+                ):
+                    wanted.append(key)
+                self.canvas.create_text(
+                    centre_x, centre_y, text=self.placeholder(name, kind), fill="gray"
+                )
+            label = name if kind != KIND_PARENT else "..."
+            if len(label) > 20:
+                label = label[:19] + "…"
+            self.canvas.create_text(
+                centre_x,
+                y + cell_height - GRID_LABEL_HEIGHT // 2 - 2,
+                text=label,
+                width=cell_width - 4,
+            )
+        self.update_scrollbar()
+        self.request_thumbnails(wanted + self.lookahead(visible.stop))
+
+    def placeholder(self, name, kind):
+        if kind in (KIND_FOLDER, KIND_PARENT):
+            return "Folder"
+        ext = os.path.splitext(name)[1]
+        return ext.upper().lstrip(".") or "File"
+
+    def lookahead(self, start):
+        # Image cells just below the screen, made once the visible ones are
+        keys = []
+        stop = min(start + GRID_LOOKAHEAD_ROWS * self.columns, len(self.view.rows))
+        for position in range(start, stop):
+            name, path, kind, size, mtime_ns, _ = self.record(self.view.rows[position])
+            key = (path, size, mtime_ns)
+            if (
+                kind == KIND_FILE
+                and os.path.splitext(name)[1].lower() in PREVIEW_IMAGE_EXTENSIONS
+                and key not in self.photos
+            ):
+                keys.append(key)
+        return keys
+
+    def update_scrollbar(self):
+        total = self.total_rows()
+        if total <= self.page_rows:
+            self.scrollbar.set(0.0, 1.0)
+        else:
+            self.scrollbar.set(self.top / total, (self.top + self.page_rows) / total)
+
+    # Thumbnails
+
+    def request_thumbnails(self, keys):
+        # Queued work that is no longer wanted is dropped, then the wanted
+        # keys not yet queued are submitted in order
+        self.cancel_pending(set(keys))
+        if self.pool is None:
+            self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=GRID_WORKERS)
+        for key in keys:
+            if key not in self.pending:
+                self.pending[key] = self.pool.submit(self.make_thumbnail, key)
+        if self.pending and not self.polling:
+            self.polling = True
+            self.canvas.after(PREVIEW_POLL_MS, self.poll)
+
+    def cancel_pending(self, keep):
+        # Thumbnails already being made are left to finish and are kept
+        for key in [key for key in self.pending if key not in keep]:
+            if self.pending[key].cancel():
+                del self.pending[key]
+
+    def make_thumbnail(self, key):
+        try:
+            image = self.thumbnails.thumbnail(key[0], (GRID_CELL_SIZE, GRID_CELL_SIZE))
+        except Exception:
+            image = None
+        self.results.put((key, image))
+
+    def poll(self):
+        # Turns finished thumbnails into PhotoImages, redrawing once per
+        # batch if any of them are on screen
+        redraw = False
+        while True:
+            try:
+                key, image = self.results.get_nowait()
+            except queue.Empty:
+                break
+            self.pending.pop(key, None)
+            self.photos[key] = ImageTk.PhotoImage(image) if image is not None else None
+            while len(self.photos) > GRID_CACHE_CELLS:
+                self.photos.popitem(last=False)
+            redraw = True
+        if redraw:
+            self.changed()
+        if self.pending:
+            self.canvas.after(PREVIEW_POLL_MS, self.poll)
+        else:
+            self.polling = False
+
+    # Scrolling
+
+    def scroll_to(self, top):
+        top = max(min(top, self.total_rows() - self.page_rows), 0)
+        if top != self.top:
+            self.top = top
+            self.render()
+
+    def scroll_by(self, rows):
+        self.scroll_to(self.top + rows)
+        return "break"
+
+    def see(self, position):
+        row = position // self.columns
+        if row < self.top:
+            self.scroll_to(row)
+        elif row >= self.top + self.page_rows:
+            self.scroll_to(row - self.page_rows + 1)
+
+    def on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            self.scroll_to(int(float(amount) * self.total_rows()))
+        elif action == "scroll":
+            step = self.page_rows if unit == "pages" else 1
+            self.scroll_by(int(amount) * step)
+
+    def on_mousewheel(self, event):
+        notches = event.delta // 120 if abs(event.delta) >= 120 else event.delta
+        return self.scroll_by(-notches)
+
+    # Selection, kept in the list view
+
+    def position_at(self, x, y):
+        cell_width, cell_height = self.cell_size()
+        column = x // cell_width
+        if column >= self.columns:
+            return None
+        position = (self.top + y // cell_height) * self.columns + column
+        return position if 0 <= position < len(self.view.rows) else None
+
+    def on_click(self, event, mode):
+        self.canvas.focus_set()
+        position = self.position_at(event.x, event.y)
+        if position is None:
+            return "break"
+        self.select(position, mode)
+        return "break"
+
+    def on_key(self, step, extend):
+        rows = self.view.rows
+        if not rows:
+            return "break"
+        current = (
+            self.top * self.columns if self.view.focus is None else self.view.focus
+        )
+        if step == "up":
+            position = current - self.columns
+        elif step == "down":
+            position = current + self.columns
+        elif step == "home":
+            position = 0
+        elif step == "end":
+            position = len(rows) - 1
+        else:
+            position = current + step
+        position = max(min(position, len(rows) - 1), 0)
+        self.select(position, "extend" if extend else "set")
+        self.see(position)
+        return "break"
+
+    def select(self, position, mode):
+        view = self.view
+        if mode == "toggle":
+            view.selection ^= {position}
+            view.anchor = position
+        elif mode == "extend" and view.anchor is not None:
+            low, high = sorted((view.anchor, position))
+            view.selection = set(range(low, high + 1))
+        else:
+            view.selection = {position}
+            view.anchor = position
+        view.focus = position
+        view.see(position)
+        view.render()
+        self.render()
+        view.notify_select()
+
+    def open(self):
+        if self.on_open is not None and self.view.focus is not None:
+            self.on_open()
+
+
+class FileManagerApp:
+    def __init__(self, root, count_workers=COUNT_WORKERS):
         self.root = root
         self.root.title("Enhanced File Manager")
         self.root.geometry("1200x700")
@@ -21,12 +2651,82 @@ class FileManagerApp:
         self.target_folder = ""
         self.recently_added = []
         self.favorites = self.load_favorites()
+        self.row_store = RowStore()
+        self.passage_index = PassageIndex(
+            os.path.join(os.path.expanduser("~"), ".file_manager_passages.db")
+        )
+        self.filename_index = FilenameIndex(
+            os.path.join(os.path.expanduser("~"), ".file_manager_names.db")
+        )
+        self.content_index = ContentIndex(
+            os.path.join(os.path.expanduser("~"), ".file_manager_contents.db")
+        )
+        # Folders to bring up to date, as (index, folder). Each is queued
+        # once however many searches ask for it; index_waiting holds the
+        # (generation, done) of the latest, and done(changed) is called on
+        # the UI thread unless that search was replaced meanwhile.
+        self.index_jobs = queue.Queue()
+        self.index_waiting = {}
+        self.index_lock = threading.Lock()
+        # folder -> time.monotonic() its content index update was queued
+        self.content_refreshed = {}
+        self.preview_cache = PreviewCache(PREVIEW_CACHE_BYTES)
+        cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+            os.path.expanduser("~"), ".cache"
+        )
+        self.thumbnail_store = ThumbnailStore(os.path.join(cache_home, "thumbnails"))
+        self.preview_loader = PreviewLoader(self.preview_cache, self.thumbnail_store)
+        self.preview_polling = False
+        self.preview_serial = None
+        self.preview_kind = None  # of the preview on show
+        self.text_window = None  # TextWindow of a big text file on show
+        # (content, rest, count) of the Word document on show, see show_docx
+        self.docx_preview = None
+        # Offsets of the previewed file's passages, and how to scroll to one
+        self.passage_offsets = array.array("q")
+        self.passage_jump = None
         self.current_sort = {"column": "Name", "reverse": False}
 
+        # Directory listings run in a worker thread; bumping the generation
+        # cancels whatever listing is still in flight
+        self.listing_generation = 0
+        self.listing_queue = queue.Queue()
+        self.listing_items = {}  # path -> row_store index, for count updates
+        self.listing_sort = dict(self.current_sort)  # order rows arrive in
+        # (folder, st_mtime_ns) the rows in row_store were listed from; the
+        # listing is reused for filtering and sorting until it changes
+        self.snapshot_key = None
+        # Watches the listed folder; its changes are queued with the listing
+        # generation and applied to row_store once the listing is complete
+        self.watcher = None
+        self.watch_queue = queue.Queue()
+        self.folder_changes = set()
+        self.listing_complete = False
+        # (dirs scanned, matches) of the running search, None when idle
+        self.search_progress = None
+        # (folder, term) of the name search whose complete results are shown,
+        # so a longer term can narrow them down instead of searching again
+        self.search_results_for = None
+        self.search_after_id = None
+        # Paths of the rows currently in view, for the counting worker
+        self.count_requests = queue.Queue()
+        self.count_request_pending = False
+
+        # Created on first use, see get_count_pool
+        self.count_workers = count_workers
+        self.count_pool = None
+        self.count_pool_size = 1
+        self.count_pool_lock = threading.Lock()
+
         # For multiple selection
         self.selected_items = []
 
         self.setup_ui()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.after(WATCH_POLL_MS, self.poll_watcher)
+        threading.Thread(target=self.index_folders, daemon=True).start()
+        for path in self.favorites.values():
+            self.queue_index_update(self.filename_index, path)
         self.initialize_target_folder()
 
     def setup_ui(self):
@@ -77,14 +2777,27 @@ class FileManagerApp:
 
         ttk.Label(search_frame, text="Search:").pack(side=tk.LEFT)
         self.search_var = tk.StringVar()
+        self.search_var.trace_add("write", lambda *args: self.on_search_typed())
         self.search_entry = ttk.Entry(
             search_frame, textvariable=self.search_var, width=30
         )
         self.search_entry.pack(side=tk.LEFT, padx=5)
         self.search_entry.bind("<Return>", lambda e: self.search_files())
+        self.root.bind("<Escape>", lambda e: self.cancel_search())
         ttk.Button(search_frame, text="Search", command=self.search_files).pack(
             side=tk.LEFT
         )
+        self.search_contents_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            search_frame, text="Search contents", variable=self.search_contents_var
+        ).pack(side=tk.LEFT, padx=5)
+        self.grid_view_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            search_frame,
+            text="Grid view",
+            variable=self.grid_view_var,
+            command=self.toggle_grid_view,
+        ).pack(side=tk.LEFT, padx=5)
 
         # Filter dropdown
         ttk.Label(search_frame, text="Filter:").pack(side=tk.LEFT, padx=(20, 5))
@@ -128,15 +2841,19 @@ class FileManagerApp:
         )
 
         # File list
+        self.list_frame = ttk.Frame(result_frame)
+        self.list_frame.pack(fill=tk.BOTH, expand=True)
         self.result_tree = ttk.Treeview(
-            result_frame,
+            self.list_frame,
             columns=(
                 "Name",
                 "Type",
                 "Size",
                 "Modified",
                 "Question Available",
+                MATCH_COLUMN,
             ),  # Updated column name
+            displaycolumns=COLUMNS,
             show="headings",
             selectmode="extended",
         )
@@ -146,27 +2863,65 @@ class FileManagerApp:
             "Size",
             "Modified",
             "Question Available",
+            MATCH_COLUMN,
         ]:  # Updated column name
             self.result_tree.heading(
                 col, text=col, command=lambda c=col: self.sort_treeview(c)
             )
             self.result_tree.column(col, width=150)
+        self.result_tree.column(MATCH_COLUMN, width=300)
 
-        scrollbar = ttk.Scrollbar(
-            result_frame, orient="vertical", command=self.result_tree.yview
-        )
-        self.result_tree.configure(yscrollcommand=scrollbar.set)
+        scrollbar = ttk.Scrollbar(self.list_frame, orient="vertical")
 
         self.result_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
 
+        # The view's rows are indices into self.row_store; only the ones on
+        # screen exist as Treeview items
+        self.file_view = VirtualTreeview(
+            self.result_tree,
+            scrollbar,
+            values=lambda index: self.row_store.values(index),
+            on_select=self.on_tree_select,
+            on_scroll=self.on_tree_scroll,
+        )
+
         self.result_tree.bind("<Double-1>", lambda e: self.open_selected())
-        self.result_tree.bind("<<TreeviewSelect>>", self.on_tree_select)
+
+        # Grid of thumbnails over the same rows (initially hidden)
+        self.grid_frame = ttk.Frame(result_frame)
+        grid_canvas = tk.Canvas(
+            self.grid_frame, background="white", highlightthickness=0
+        )
+        grid_scrollbar = ttk.Scrollbar(self.grid_frame, orient="vertical")
+        grid_canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        grid_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.thumbnail_grid = ThumbnailGrid(
+            grid_canvas,
+            grid_scrollbar,
+            self.file_view,
+            record=lambda index: self.row_store.record(index),
+            thumbnails=self.thumbnail_store,
+            on_open=self.open_selected,
+        )
 
         # Text Preview Panel
         preview_label_frame = ttk.Frame(right_frame)
         preview_label_frame.pack(fill=tk.X)
         ttk.Label(preview_label_frame, text="Preview:").pack(side=tk.LEFT)
+        self.passage_var = tk.StringVar()
+        self.passage_list = ttk.Combobox(
+            preview_label_frame,
+            textvariable=self.passage_var,
+            width=40,
+            state="disabled",
+        )
+        self.passage_list.pack(side=tk.RIGHT)
+        self.passage_list.bind("<<ComboboxSelected>>", lambda e: self.jump_to_passage())
+        self.passage_list.bind("<Return>", lambda e: self.jump_to_passage())
+        ttk.Label(preview_label_frame, text="Jump to passage:").pack(
+            side=tk.RIGHT, padx=5
+        )
 
         # Preview frame will contain either text or image preview
         self.preview_frame = ttk.Frame(right_frame)
@@ -175,6 +2930,7 @@ class FileManagerApp:
         # Text preview
         self.preview_text = ScrolledText(self.preview_frame, wrap=tk.WORD, height=38)
         self.preview_text.pack(fill=tk.BOTH, expand=True)
+        self.preview_text.bind("<Control-g>", lambda e: self.goto_preview_line())
 
         # Image preview (initially hidden)
         self.image_label = ttk.Label(self.preview_frame)
@@ -247,6 +3003,7 @@ class FileManagerApp:
 
         self.favorites[name] = self.target_folder
         self.save_favorites()
+        self.queue_index_update(self.filename_index, self.target_folder)
         self.setup_favorites_sidebar()
         self.status_var.set(f"Added '{self.target_folder}' to favorites as '{name}'")
 
@@ -272,6 +3029,8 @@ class FileManagerApp:
         self.target_folder = path
         self.folder_path_var.set(path)
         self.view_contents()
+        if not self.filename_index.covers(path):
+            self.queue_index_update(self.filename_index, path)
         self.root.title(f"Enhanced File Manager - {os.path.basename(path)}")
         self.status_var.set(f"Current location: {path}")
 
@@ -280,175 +3039,973 @@ class FileManagerApp:
         if folder:
             self.set_target_folder(folder)
 
-    def get_file_type_category(self, file_path):
-        _, ext = os.path.splitext(file_path)
-        ext = ext.lower()
-
-        if ext in [".docx", ".doc", ".txt", ".pdf", ".rtf", ".odt", ".md"]:
-            return "Documents"
-        elif ext in [".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tiff", ".svg"]:
-            return "Images"
-        elif ext in [".mp4", ".avi", ".mov", ".mkv", ".flv", ".wmv"]:
-            return "Videos"
-        elif ext in [".mp3", ".wav", ".ogg", ".flac", ".aac"]:
-            return "Audio"
-        elif ext in [".zip", ".rar", ".7z", ".tar", ".gz"]:
-            return "Archives"
-        else:
-            return "Other"
-
-    def view_contents(self):
-        self.result_tree.delete(*self.result_tree.get_children())
+    def on_close(self):
+        self.cancel_listing()
+        self.thumbnail_grid.close()
+        # Queued counts are dropped so a big file still waiting to be
+        # counted doesn't hold up exiting
+        if self.count_pool is not None:
+            self.count_pool.shutdown(wait=False, cancel_futures=True)
+        self.root.destroy()
+
+    def view_contents(self, refresh=False):
         if not os.path.exists(self.target_folder) or not self.target_folder:
+            self.cancel_listing()
+            self.snapshot_key = None
+            self.row_store = RowStore()
+            self.file_view.set_rows(array.array("l"))
             return
 
+        # Same folder, unchanged since it was listed: just filter and sort
+        # the rows already in memory
         try:
-            items = []
-
-            # Add "..." entry to go back to the previous folder
-            parent_folder = os.path.dirname(self.target_folder)
-            if parent_folder and parent_folder != self.target_folder:
-                self.result_tree.insert(
-                    "", tk.END, values=("...", "Folder", "-", "-", "-")
-                )
+            folder_mtime = os.stat(self.target_folder).st_mtime_ns
+        except OSError:
+            folder_mtime = None
+        snapshot_key = (self.target_folder, folder_mtime)
+        if not refresh and snapshot_key == self.snapshot_key:
+            self.show_snapshot()
+            return
 
-            for item in os.listdir(self.target_folder):
-                full_path = os.path.join(self.target_folder, item)
+        generation = self.cancel_listing()
+        self.show_match_column(False)
+        self.snapshot_key = snapshot_key
+        self.row_store = RowStore()
+        self.listing_items = {}
+        self.file_view.set_rows(array.array("l"))
+
+        # Watch before listing so nothing changed meanwhile is missed
+        self.folder_changes = set()
+        self.listing_complete = False
+        self.watcher = watch_directory(
+            self.target_folder,
+            lambda names: self.watch_queue.put((generation, "changes", names)),
+        )
 
-                # Skip hidden files
-                if item.startswith("."):
-                    continue
+        # Add "..." entry to go back to the previous folder
+        parent_folder = os.path.dirname(self.target_folder)
+        if parent_folder and parent_folder != self.target_folder:
+            parent = self.row_store.append(
+                "...", parent_folder, KIND_PARENT, UNKNOWN, UNKNOWN, COUNT_NONE
+            )
+            self.file_view.append_rows([parent])
+
+        self.status_var.set(f"Listing {self.target_folder}...")
+        self.listing_sort = dict(self.current_sort)
+        threading.Thread(
+            target=self.list_directory,
+            args=(generation, self.target_folder, self.listing_sort),
+            daemon=True,
+        ).start()
+        self.root.after(LISTING_POLL_MS, self.poll_listing, generation)
+
+    def show_snapshot(self):
+        # Rebuilds the view from row_store with the current filter and sort;
+        # the "..." row stays on top. A listing still in progress keeps
+        # appending to it.
+        store = self.row_store
+        pinned = 1 if len(store) and store.kinds[0] == KIND_PARENT else 0
+        rows = store.filtered(range(pinned, len(store)), self.filter_var.get())
+        self.file_view.set_rows(
+            array.array("l", range(pinned))
+            + store.sorted(
+                rows, self.current_sort["column"], self.current_sort["reverse"]
+            )
+        )
+        # Rows still to come arrive in listing_sort order and are sorted
+        # once the listing ends
+        if self.listing_complete:
+            self.listing_sort = dict(self.current_sort)
+        self.show_listing_status()
+
+    def show_listing_status(self):
+        rows = self.file_view.rows
+        pinned = 1 if rows and self.row_store.kinds[rows[0]] == KIND_PARENT else 0
+        self.status_var.set(
+            f"Displayed {len(rows) - pinned} items in {self.target_folder}"
+        )
 
-                if os.path.isfile(full_path):
-                    file_type = "File"
-                    type_category = self.get_file_type_category(full_path)
-                    try:
-                        size = os.path.getsize(full_path)
-                        size_str = self.format_file_size(size)
-                    except:
-                        size_str = "Unknown"
-
-                    # Count numbered passages for text-based files
-                    if type_category == "Documents":
-                        try:
-                            with open(
-                                full_path, "r", encoding="utf-8", errors="ignore"
-                            ) as f:
-                                content = f.read()
-                                numbered_passages_count = self.count_numbered_passages(
-                                    content
-                                )
-                        except:
-                            numbered_passages_count = "N/A"
-                    else:
-                        numbered_passages_count = "N/A"
-                else:
-                    file_type = "Folder"
-                    type_category = "Folder"
-                    size_str = "-"
-                    numbered_passages_count = "-"
-
-                # Apply filter if not "All Files"
-                filter_category = self.filter_var.get()
-                if filter_category != "All Files":
-                    if filter_category == "Folders Only" and file_type != "Folder":
-                        continue
-                    elif (
-                        filter_category != "Folders Only"
-                        and type_category != filter_category
-                    ):
+    def cancel_listing(self):
+        # Stops the running listing (it checks the generation between
+        # entries) and makes the poller drop any rows it already queued.
+        # The folder's watcher goes with it.
+        self.listing_generation += 1
+        self.search_progress = None
+        self.search_results_for = None
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+        return self.listing_generation
+
+    def list_directory(self, generation, folder, sort):
+        # Runs in a worker thread: must not touch any Tk widget or variable.
+        # Rows are gathered in a private RowStore and copied over to the
+        # UI's store batch by batch.
+        try:
+            store = RowStore()
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if generation != self.listing_generation:
+                        return
+
+                    # Skip hidden files
+                    if entry.name.startswith("."):
                         continue
 
-                try:
-                    modified = datetime.fromtimestamp(
-                        os.path.getmtime(full_path)
-                    ).strftime("%Y-%m-%d %H:%M:%S")
-                except:
-                    modified = "Unknown"
-
-                items.append(
-                    (item, file_type, size_str, modified, numbered_passages_count)
-                )
+                    self.add_listing_entry(store, entry)
+
+            # Cached counts are filled in straight away; the rest go out as
+            # placeholders and are counted in the pool
+            self.lookup_passage_counts(store)
 
             # Sort items according to current sort settings
-            col_index = [
-                "Name",
-                "Type",
-                "Size",
-                "Modified",
-                "Question Available",
-            ].index(self.current_sort["column"])
-            items.sort(key=lambda x: x[col_index], reverse=self.current_sort["reverse"])
-
-            for item, file_type, size, modified, numbered_passages_count in items:
-                self.result_tree.insert(
-                    "",
-                    tk.END,
-                    values=(item, file_type, size, modified, numbered_passages_count),
+            order = store.sorted(range(len(store)), sort["column"], sort["reverse"])
+
+            for start in range(0, len(order), LISTING_BATCH_SIZE):
+                if generation != self.listing_generation:
+                    return
+                batch = order[start : start + LISTING_BATCH_SIZE]
+                self.listing_queue.put(
+                    (generation, "rows", [store.record(i) for i in batch])
                 )
+            self.listing_queue.put((generation, "listed", len(order)))
 
-            self.status_var.set(f"Displayed {len(items)} items in {self.target_folder}")
+            if not self.count_passages(generation, store, order):
+                return
+            self.listing_queue.put((generation, "done", len(order)))
 
         except Exception as e:
-            messagebox.showerror("Error", f"Error reading directory: {e}")
-
-    def format_file_size(self, size_bytes):
-        # Convert file size to a human-readable format
-        for unit in ["B", "KB", "MB", "GB", "TB"]:
-            if size_bytes < 1024:
-                return f"{size_bytes:.1f} {unit}"
-            size_bytes /= 1024
-        return f"{size_bytes:.1f} PB"
-
-    def search_files(self):
-        search_term = self.search_var.get().strip().lower()
+            self.listing_queue.put((generation, "error", e))
+
+    def add_listing_entry(self, store, entry):
+        # Every entry is kept whatever the filter, so changing the filter
+        # doesn't need a new listing. DirEntry caches its stat result, so
+        # each entry costs at most one stat call (none for the type on most
+        # platforms).
+        try:
+            is_file = entry.is_file()
+        except OSError:
+            is_file = False
+
+        try:
+            st = entry.stat()
+        except OSError:
+            st = None
+
+        store.append(*listing_record(entry.name, entry.path, is_file, st))
+
+    def lookup_passage_counts(self, store):
+        # Fills in counts for files whose (path, size, mtime_ns) is already
+        # in the index
+        for i in range(len(store)):
+            if store.counts[i] == COUNT_PENDING and store.mtimes[i] != UNKNOWN:
+                count = self.passage_index.get(
+                    store.paths[i], store.sizes[i], store.mtimes[i]
+                )
+                if count is not None:
+                    store.counts[i] = count
+
+    def get_count_pool(self):
+        with self.count_pool_lock:
+            if self.count_pool is None:
+                try:
+                    # Workers are started fresh rather than forked from this
+                    # process and its threads
+                    self.count_pool = concurrent.futures.ProcessPoolExecutor(
+                        max_workers=self.count_workers,
+                        mp_context=multiprocessing.get_context("spawn"),
+                    )
+                    self.count_pool_size = self.count_workers or os.cpu_count() or 1
+                except (ValueError, OSError, NotImplementedError):
+                    # count_workers=0, or no multiprocessing on this platform
+                    self.count_pool = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=1
+                    )
+                    self.count_pool_size = 1
+            return self.count_pool
+
+    def reset_count_pool(self, broken_pool):
+        # A worker process died; later counts go to a fresh pool
+        with self.count_pool_lock:
+            if self.count_pool is broken_pool:
+                self.count_pool = None
+        broken_pool.shutdown(wait=False)
+
+    def count_passages(self, generation, store, order):
+        # Counts every row still missing a count in the process pool, saving
+        # results to the index and posting them to the UI as futures
+        # complete. Rows the UI reports as visible go first; the
+        # rest are filled in at idle priority. Returns False if the listing
+        # was cancelled meanwhile; its in-flight counts are cancelled too.
+        waiting = {store.paths[i]: i for i in order if store.counts[i] == COUNT_PENDING}
+        visible = collections.deque()
+        in_flight = {}
+
+        while waiting or in_flight:
+            if generation != self.listing_generation:
+                for future in in_flight:
+                    future.cancel()
+                return False
+
+            # Only the latest visible window matters
+            while True:
+                try:
+                    request_generation, paths = self.count_requests.get_nowait()
+                except queue.Empty:
+                    break
+                if request_generation == generation:
+                    visible = collections.deque(paths)
+
+            pool = self.get_count_pool()
+            busy_limit = self.count_pool_size * COUNT_JOBS_PER_WORKER
+            idle_limit = self.count_pool_size
+            while waiting and len(in_flight) < busy_limit:
+                index = None
+                while visible and index is None:
+                    index = waiting.pop(visible.popleft(), None)
+                if index is None:
+                    if len(in_flight) >= idle_limit:
+                        break
+                    index = waiting.pop(next(iter(waiting)))
+                path = store.paths[index]
+                try:
+                    in_flight[pool.submit(find_file_passages, path)] = index
+                except concurrent.futures.BrokenExecutor:
+                    self.reset_count_pool(pool)
+                    waiting[path] = index
+                    break
+
+            if not in_flight:
+                continue
+
+            done, _ = concurrent.futures.wait(
+                in_flight,
+                timeout=COUNT_WAIT_SECONDS,
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+            updates = []
+            fresh = []
+            for future in done:
+                index = in_flight.pop(future)
+                try:
+                    count, offsets = future.result()
+                except concurrent.futures.BrokenExecutor:
+                    self.reset_count_pool(pool)
+                    count, offsets = "N/A", None
+                except Exception:
+                    count, offsets = "N/A", None
+                store.set_count(index, count)
+                path = store.paths[index]
+                updates.append((path, count))
+                if store.mtimes[index] != UNKNOWN and count != "N/A":
+                    fresh.append(
+                        (path, store.sizes[index], store.mtimes[index], count, offsets)
+                    )
+            if fresh:
+                self.passage_index.put_many(fresh)
+            if updates:
+                self.listing_queue.put((generation, "counts", updates))
+
+        return True
+
+    def on_tree_scroll(self):
+        # Called for every scroll step and every batch of appended rows;
+        # the visible window is worked out once things settle
+        self.thumbnail_grid.changed()
+        if not self.count_request_pending:
+            self.count_request_pending = True
+            self.root.after_idle(self.request_visible_counts)
+
+    def toggle_grid_view(self):
+        if self.grid_view_var.get():
+            self.list_frame.pack_forget()
+            self.grid_frame.pack(fill=tk.BOTH, expand=True)
+            self.thumbnail_grid.show()
+            self.thumbnail_grid.canvas.focus_set()
+        else:
+            self.thumbnail_grid.hide()
+            self.grid_frame.pack_forget()
+            self.list_frame.pack(fill=tk.BOTH, expand=True)
+
+    def request_visible_counts(self):
+        self.count_request_pending = False
+        first, last = self.file_view.visible_range()
+        store = self.row_store
+        if store.unchecked:
+            self.check_rows(self.file_view.rows[first:last])
+        nearby = self.file_view.rows[
+            max(first - COUNT_PREFETCH_ROWS, 0) : last + COUNT_PREFETCH_ROWS
+        ]
+        paths = [store.paths[i] for i in nearby if store.counts[i] == COUNT_PENDING]
+        if paths:
+            self.count_requests.put((self.listing_generation, paths))
+
+    def check_rows(self, rows):
+        # Stats the rows among these whose size and mtime came from the index
+        store = self.row_store
+        changed = False
+        for index in rows:
+            if index not in store.unchecked:
+                continue
+            store.unchecked.discard(index)
+            try:
+                st = os.stat(store.paths[index])
+            except OSError:
+                continue
+            size = UNKNOWN if store.kinds[index] == KIND_FOLDER else st.st_size
+            if (store.sizes[index], store.mtimes[index]) != (size, st.st_mtime_ns):
+                store.sizes[index] = size
+                store.mtimes[index] = st.st_mtime_ns
+                changed = True
+        if changed:
+            self.file_view.refresh()
+
+    def poll_listing(self, generation):
+        if generation != self.listing_generation:
+            return
+
+        for _ in range(LISTING_BATCHES_PER_POLL):
+            try:
+                msg_generation, kind, payload = self.listing_queue.get_nowait()
+            except queue.Empty:
+                break
+
+            # Leftovers from a cancelled listing
+            if msg_generation != generation:
+                continue
+
+            if kind == "rows":
+                indices = []
+                for record in payload:
+                    index = self.row_store.append(*record)
+                    self.listing_items[record[1]] = index
+                    indices.append(index)
+                self.file_view.append_rows(
+                    self.row_store.filtered(indices, self.filter_var.get())
+                )
+            elif kind == "counts":
+                for path, count in payload:
+                    index = self.listing_items.get(path)
+                    if index is not None:
+                        self.row_store.set_count(index, count)
+                self.file_view.refresh()
+            elif kind == "listed":
+                self.listing_complete = True
+                self.show_listing_status()
+                # The sort was changed while rows were still arriving
+                if self.listing_sort != self.current_sort:
+                    self.apply_sort()
+                    self.listing_sort = dict(self.current_sort)
+            elif kind == "matches":
+                records, scanned, matches = payload
+                if records:
+                    indices = [self.row_store.append(*record) for record in records]
+                    self.file_view.append_rows(indices)
+                self.search_progress = (scanned, matches)
+                self.status_var.set(
+                    f"Searching... scanned {scanned} dirs / {matches} matches"
+                )
+            elif kind == "searched":
+                self.search_progress = None
+                self.search_results_for = (self.target_folder, payload)
+                if self.listing_sort is not None:
+                    self.apply_sort()
+                self.status_var.set(
+                    f"Found {len(self.row_store)} items matching '{payload.text}'"
+                )
+                return
+            elif kind == "index matches":
+                store, query, updating = payload
+                self.row_store = store
+                self.file_view.set_rows(array.array("l", range(len(store))))
+                if self.listing_sort is not None:
+                    self.apply_sort()
+                self.search_results_for = (self.target_folder, query)
+                self.status_var.set(f"Found {len(store)} items matching '{query.text}'")
+                # An update of the index follows, see search_index
+                if not updating:
+                    return
+            elif kind == "content matches":
+                store, search_term, updating = payload
+                self.row_store = store
+                self.file_view.set_rows(array.array("l", range(len(store))))
+                if self.listing_sort is not None:
+                    self.apply_sort()
+                self.show_match_column(True)
+                status = f"Found {len(store)} documents containing '{search_term}'"
+                if updating:
+                    status += " (updating the index...)"
+                self.status_var.set(status)
+                if not updating:
+                    return
+            elif kind == "indexed":
+                done, changed = payload
+                done(changed)
+                return
+            elif kind == "search error":
+                self.search_progress = None
+                messagebox.showerror("Error", f"Error during search: {payload}")
+                return
+            elif kind == "done":
+                # Rows sorted by count can only be placed once all are known
+                if self.current_sort["column"] == "Question Available":
+                    self.apply_sort()
+                return
+            elif kind == "error":
+                # Nothing was listed, so there is nothing for the watcher to
+                # refresh; a rescan would only fail again
+                if self.watcher is not None:
+                    self.watcher.stop()
+                    self.watcher = None
+                messagebox.showerror("Error", f"Error reading directory: {payload}")
+                return
+
+        self.root.after(LISTING_POLL_MS, self.poll_listing, generation)
+
+    def poll_watcher(self):
+        # Runs for the lifetime of the window. Changes reported while rows
+        # are still arriving wait for the listing to complete, as the
+        # entries may not be in row_store yet.
+        rescan = False
+        while True:
+            try:
+                generation, kind, payload = self.watch_queue.get_nowait()
+            except queue.Empty:
+                break
+            if generation != self.listing_generation:
+                continue
+
+            if kind == "changes":
+                if payload is None:
+                    rescan = True
+                else:
+                    self.folder_changes |= payload
+            elif kind == "counts":
+                path, mtime_ns, count = payload
+                index = self.listing_items.get(path)
+                # Ignore counts of a version that has since changed again
+                if index is not None and self.row_store.mtimes[index] == mtime_ns:
+                    self.row_store.set_count(index, count)
+                    self.file_view.refresh()
+
+        if rescan:
+            self.view_contents(refresh=True)
+        elif self.folder_changes and self.listing_complete:
+            changes = self.folder_changes
+            self.folder_changes = set()
+            self.apply_folder_changes(changes)
+        self.root.after(WATCH_POLL_MS, self.poll_watcher)
+
+    def apply_folder_changes(self, names):
+        # Brings the rows of just these entries of target_folder up to date,
+        # whether they were created, deleted, renamed or written, so one
+        # changed file costs one row update instead of a new listing
+        store = self.row_store
+        for name in names:
+            if not name or name.startswith("."):
+                continue
+            path = os.path.join(self.target_folder, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                st = None
+            exists = st is not None or os.path.lexists(path)
+            is_file = st is not None and stat.S_ISREG(st.st_mode)
+
+            index = self.listing_items.get(path)
+            if index is None:
+                if exists:
+                    self.insert_listing_row(listing_record(name, path, is_file, st))
+                continue
+            if not exists:
+                self.remove_listing_row(index)
+                continue
+
+            record = listing_record(name, path, is_file, st)
+            if record[2:5] == store.record(index)[2:5]:
+                continue
+            if record[2] != store.kinds[index]:
+                # A file replaced by a folder or the other way round
+                self.remove_listing_row(index)
+                self.insert_listing_row(record)
+            else:
+                self.update_listing_row(index, record)
+
+        try:
+            folder_mtime = os.stat(self.target_folder).st_mtime_ns
+        except OSError:
+            folder_mtime = None
+        self.snapshot_key = (self.target_folder, folder_mtime)
+        self.show_listing_status()
+
+    def refresh_entries(self, names):
+        # After a file operation, so the list doesn't wait for the watcher.
+        # Search results are replaced by the folder listing.
+        if self.snapshot_key is None:
+            self.view_contents(refresh=True)
+        elif self.listing_complete:
+            self.apply_folder_changes(names)
+        else:
+            self.folder_changes.update(names)
+
+    def insert_listing_row(self, record):
+        store = self.row_store
+        index = store.append(*record)
+        self.listing_items[record[1]] = index
+        if store.counts[index] == COUNT_PENDING:
+            self.recount_passages(index)
+        if store.filtered([index], self.filter_var.get()):
+            self.file_view.insert_row(self.sorted_position(index), index)
+
+    def remove_listing_row(self, index):
+        store = self.row_store
+        del self.listing_items[store.paths[index]]
+        store.remove(index)
+        try:
+            position = self.file_view.rows.index(index)
+        except ValueError:
+            return  # filtered out
+        self.file_view.remove_row(position)
+
+    def update_listing_row(self, index, record):
+        store = self.row_store
+        _, _, _, size, mtime_ns, count = record
+        store.sizes[index] = size
+        store.mtimes[index] = mtime_ns
+        store.counts[index] = count
+        if count == COUNT_PENDING:
+            self.recount_passages(index)
+
+        try:
+            position = self.file_view.rows.index(index)
+        except ValueError:
+            return  # filtered out
+        if self.current_sort["column"] in ("Size", "Modified", "Question Available"):
+            self.file_view.remove_row(position)
+            self.file_view.insert_row(self.sorted_position(index), index)
+        else:
+            self.file_view.refresh()
+
+    def sorted_position(self, index):
+        # Where index goes in the sorted view, after any equal rows, found by
+        # bisection; the "..." row stays on top
+        store = self.row_store
+        rows = self.file_view.rows
+        key = store.sort_key(self.current_sort["column"])
+        reverse = self.current_sort["reverse"]
+        value = key(index)
+        low = 1 if rows and store.kinds[rows[0]] == KIND_PARENT else 0
+        high = len(rows)
+        while low < high:
+            middle = (low + high) // 2
+            other = key(rows[middle])
+            if other >= value if reverse else other <= value:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def recount_passages(self, index):
+        # Counts a document that appeared or changed after its folder was
+        # listed; the listing's own counting may have finished long ago
+        store = self.row_store
+        path, size, mtime_ns = (
+            store.paths[index],
+            store.sizes[index],
+            store.mtimes[index],
+        )
+        if mtime_ns != UNKNOWN:
+            count = self.passage_index.get(path, size, mtime_ns)
+            if count is not None:
+                store.counts[index] = count
+                return
+
+        generation = self.listing_generation
+        pool = self.get_count_pool()
+
+        def finished(future):
+            try:
+                count, offsets = future.result()
+            except concurrent.futures.BrokenExecutor:
+                self.reset_count_pool(pool)
+                count, offsets = "N/A", None
+            except Exception:
+                count, offsets = "N/A", None
+            if mtime_ns != UNKNOWN and count != "N/A":
+                self.passage_index.put_many([(path, size, mtime_ns, count, offsets)])
+            self.watch_queue.put((generation, "counts", (path, mtime_ns, count)))
+
+        try:
+            pool.submit(find_file_passages, path).add_done_callback(finished)
+        except concurrent.futures.BrokenExecutor:
+            self.reset_count_pool(pool)
+            store.counts[index] = COUNT_NA
+
+    def on_search_typed(self):
+        # Each keystroke pushes the search back until typing pauses
+        if self.search_after_id is not None:
+            self.root.after_cancel(self.search_after_id)
+        self.search_after_id = self.root.after(
+            SEARCH_DEBOUNCE_MS, self.search_files, True
+        )
+
+    def search_files(self, typed=False):
+        if self.search_after_id is not None:
+            self.root.after_cancel(self.search_after_id)
+            self.search_after_id = None
+
+        search_term = self.search_var.get().strip()
         if not search_term:
             self.view_contents()
             return
 
-        self.result_tree.delete(*self.result_tree.get_children())
+        if self.search_contents_var.get():
+            query = None
+            # Typed searches don't pop up the error every pause
+            if not self.content_index.available:
+                if typed:
+                    self.status_var.set(
+                        "Content search needs SQLite with the FTS5 extension"
+                    )
+                else:
+                    messagebox.showerror(
+                        "Error", "Content search needs SQLite with the FTS5 extension"
+                    )
+                return
+            if typed and len(search_term) < SEARCH_TYPED_MIN_CHARS:
+                self.status_var.set(f"Press Enter to search for '{search_term}'")
+                return
+        else:
+            try:
+                query = SearchQuery(search_term)
+            except ValueError as e:
+                self.status_var.set(f"Invalid search: {e}")
+                return
+
+            # A query narrowing the previous one can only match a subset of
+            # its results. Counts would have to be read, and sizes taken from
+            # the index may be stale, so those search again.
+            previous = self.search_results_for
+            if (
+                previous is not None
+                and previous[0] == self.target_folder
+                and query.narrows(previous[1])
+                and not query.count_tests
+                and not (query.stat_tests and self.row_store.unchecked)
+            ):
+                self.narrow_search(query)
+                return
+
+            if (
+                typed
+                and query.substrings
+                and len(query.literal) < SEARCH_TYPED_MIN_CHARS
+            ):
+                self.status_var.set(f"Press Enter to search for '{search_term}'")
+                return
+
+        # Replaces whatever listing or search is running
+        generation = self.cancel_listing()
+        self.show_match_column(False)
+        self.snapshot_key = None
+        self.row_store = RowStore()
+        self.listing_items = {}
+        self.file_view.set_rows(array.array("l"))
         if not os.path.exists(self.target_folder):
             return
 
-        try:
-            matching_items = []
-            for root, dirs, files in os.walk(self.target_folder):
-                for item in files + dirs:
-                    if search_term in item.lower():
-                        full_path = os.path.join(root, item)
-                        rel_path = os.path.relpath(full_path, self.target_folder)
+        # Matches are shown in the order they are found; a sort picked
+        # meanwhile is applied when the search ends
+        self.listing_sort = None
+        if query is None:
+            self.search_contents(generation, search_term.lower(), typed)
+            return
 
-                        if os.path.isfile(full_path):
-                            file_type = "File"
-                            try:
-                                size = os.path.getsize(full_path)
-                                size_str = self.format_file_size(size)
-                            except:
-                                size_str = "Unknown"
-                        else:
-                            file_type = "Folder"
-                            size_str = "-"
+        # An indexed folder is answered from the index; the index is then
+        # brought up to date and the search redone if anything changed.
+        # Queries without a plain word would read the whole index, and
+        # passage counts aren't in it, so those walk the disk.
+        self.status_var.set(f"Searching for '{search_term}'...")
+        if (
+            query.literal
+            and not query.count_tests
+            and self.filename_index.covers(self.target_folder)
+        ):
+            self.start_index_search(generation, self.target_folder, query, True)
+            return
 
-                        try:
-                            modified = datetime.fromtimestamp(
-                                os.path.getmtime(full_path)
-                            ).strftime("%Y-%m-%d %H:%M:%S")
-                        except:
-                            modified = "Unknown"
+        self.search_progress = (0, 0)
+        threading.Thread(
+            target=self.search_directory,
+            args=(generation, self.target_folder, query),
+            daemon=True,
+        ).start()
+        self.root.after(LISTING_POLL_MS, self.poll_listing, generation)
+
+    def search_directory(self, generation, folder, query):
+        # Runs in a worker thread, like list_directory. Walks the tree
+        # breadth first with scandir, so nearby matches come first, and
+        # posts matches in batches along with the progress counter.
+        # Unreadable subfolders are skipped. Entries are only stat'ed once
+        # their name passes, and only counted once everything else has.
+        try:
+            pending = collections.deque([folder])
+            batch = []
+            scanned = matches = 0
+            last_post = time.monotonic()
+            while pending:
+                directory = pending.popleft()
+                try:
+                    with os.scandir(directory) as entries:
+                        for entry in entries:
+                            if generation != self.listing_generation:
+                                return
+                            try:
+                                is_dir = entry.is_dir(follow_symlinks=False)
+                            except OSError:
+                                is_dir = False
+                            if is_dir:
+                                pending.append(entry.path)
+
+                            if not query.match_name(entry.name):
+                                continue
+                            try:
+                                is_file = entry.is_file()
+                            except OSError:
+                                is_file = False
+                            if not query.match_kind(not is_file):
+                                continue
+                            try:
+                                st = entry.stat()
+                            except OSError:
+                                st = None
+                            rel_path = os.path.relpath(entry.path, folder)
+                            record = listing_record(rel_path, entry.path, is_file, st)
+                            if not query.match_stat(record[3], record[4]):
+                                continue
+                            count = COUNT_BLANK
+                            if query.count_tests:
+                                count = self.search_passage_count(record)
+                                if not query.match_count(count):
+                                    continue
+                            batch.append(record[:5] + (count,))
+                            matches += 1
+                except OSError:
+                    if directory == folder:
+                        raise
+                scanned += 1
+
+                if (
+                    len(batch) >= LISTING_BATCH_SIZE
+                    or time.monotonic() - last_post >= SEARCH_PROGRESS_SECONDS
+                ):
+                    self.listing_queue.put(
+                        (generation, "matches", (batch, scanned, matches))
+                    )
+                    batch = []
+                    last_post = time.monotonic()
 
-                        matching_items.append((rel_path, file_type, size_str, modified))
+            self.listing_queue.put((generation, "matches", (batch, scanned, matches)))
+            self.listing_queue.put((generation, "searched", query))
 
-            for item_path, file_type, size, modified in matching_items:
-                self.result_tree.insert(
-                    "", tk.END, values=(item_path, file_type, size, modified)
-                )
+        except Exception as e:
+            self.listing_queue.put((generation, "search error", e))
+
+    def search_passage_count(self, record):
+        # Passage count for a questions>= query, from the index if possible
+        _, path, kind, size, mtime_ns, count = record
+        if count != COUNT_PENDING:
+            return "N/A"
+        if mtime_ns != UNKNOWN:
+            cached = self.passage_index.get(path, size, mtime_ns)
+            if cached is not None:
+                return cached
+        count, offsets = find_file_passages(path)
+        if mtime_ns != UNKNOWN and count != "N/A":
+            self.passage_index.put_many([(path, size, mtime_ns, count, offsets)])
+        return count
+
+    def narrow_search(self, query):
+        # Also drops a pending refresh of the broader results
+        self.cancel_listing()
+        store = self.row_store
+        self.file_view.set_rows(
+            array.array(
+                "l",
+                (
+                    i
+                    for i in self.file_view.rows
+                    if query.match_row(
+                        os.path.basename(store.names[i]),
+                        store.kinds[i] == KIND_FOLDER,
+                        store.sizes[i],
+                        store.mtimes[i],
+                    )
+                ),
+            )
+        )
+        self.search_results_for = (self.target_folder, query)
+        self.status_var.set(
+            f"Found {len(self.file_view.rows)} items matching '{query.text}'"
+        )
 
-            self.status_var.set(
-                f"Found {len(matching_items)} items matching '{search_term}'"
+    def start_index_search(self, generation, folder, query, update):
+        threading.Thread(
+            target=self.search_index,
+            args=(generation, folder, query, update),
+            daemon=True,
+        ).start()
+        self.root.after(LISTING_POLL_MS, self.poll_listing, generation)
+
+    def search_index(self, generation, folder, query, update):
+        # Runs in a worker thread, like search_directory: looks the query up
+        # in the filename index and posts all the matching rows at once.
+        # With update, the folder's index is then brought up to date, and
+        # the lookup redone if that changed anything.
+        try:
+            store = RowStore()
+            for path, is_dir, size, mtime_ns in self.filename_index.search(
+                folder, query.literal
+            ):
+                if generation != self.listing_generation:
+                    return
+                name = os.path.basename(path)
+                if not query.match_name(name) or not query.match_kind(is_dir):
+                    continue
+                relpath = os.path.relpath(path, folder)
+                if not query.stat_tests:
+                    index = store.append(
+                        relpath,
+                        path,
+                        KIND_FOLDER if is_dir else KIND_FILE,
+                        size,
+                        mtime_ns,
+                        COUNT_BLANK,
+                    )
+                    store.unchecked.add(index)
+                    continue
+                # The index only sees a file edited in place once its folder
+                # changes, so size and date tests need a fresh stat
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                is_file = stat.S_ISREG(st.st_mode)
+                record = listing_record(relpath, path, is_file, st)
+                if not query.match_kind(not is_file) or not query.match_stat(
+                    record[3], record[4]
+                ):
+                    continue
+                store.append(*record[:5], COUNT_BLANK)
+        except Exception as e:
+            self.listing_queue.put((generation, "search error", e))
+            return
+        # Posted before the update is queued, so it arrives before "indexed"
+        self.listing_queue.put((generation, "index matches", (store, query, update)))
+        if update:
+            self.queue_index_update(
+                self.filename_index,
+                folder,
+                generation,
+                lambda changed: changed
+                and self.start_index_search(generation, folder, query, False),
             )
 
+    def search_contents(self, generation, search_term, typed=False):
+        # Like the filename index: hits already indexed are shown at once,
+        # then the folder's documents are re-read where they changed and
+        # the search is redone. While typing, the folder is re-read at most
+        # once per CONTENT_REFRESH_SECONDS.
+        folder = self.target_folder
+        now = time.monotonic()
+        refreshed = self.content_refreshed.get(folder)
+        update = not (
+            typed
+            and refreshed is not None
+            and now - refreshed < CONTENT_REFRESH_SECONDS
+        )
+        if update:
+            self.content_refreshed[folder] = now
+        self.status_var.set(f"Searching for '{search_term}'...")
+        self.start_content_search(generation, folder, search_term, update)
+
+    def start_content_search(self, generation, folder, search_term, update):
+        threading.Thread(
+            target=self.search_content_index,
+            args=(generation, folder, search_term, update),
+            daemon=True,
+        ).start()
+        self.root.after(LISTING_POLL_MS, self.poll_listing, generation)
+
+    def search_content_index(self, generation, folder, search_term, update):
+        # Runs in a worker thread, like search_index, since the lookup waits
+        # while an update holds the content index's lock. With update, the
+        # folder's documents are then re-read and the lookup redone.
+        try:
+            store = RowStore()
+            for path, size, mtime_ns, snippet in self.content_index.search(
+                folder, search_term
+            ):
+                index = store.append(
+                    os.path.relpath(path, folder),
+                    path,
+                    KIND_FILE,
+                    size,
+                    mtime_ns,
+                    COUNT_BLANK,
+                )
+                store.snippets[index] = snippet
         except Exception as e:
-            messagebox.showerror("Error", f"Error during search: {e}")
+            self.listing_queue.put((generation, "search error", e))
+            return
+        self.listing_queue.put(
+            (generation, "content matches", (store, search_term, update))
+        )
+        if update:
+            self.queue_index_update(
+                self.content_index,
+                folder,
+                generation,
+                lambda changed: self.start_content_search(
+                    generation, folder, search_term, False
+                ),
+            )
+
+    def show_match_column(self, show):
+        self.result_tree.configure(
+            displaycolumns=COLUMNS + (MATCH_COLUMN,) if show else COLUMNS
+        )
+
+    def queue_index_update(self, index, folder, generation=None, done=None):
+        with self.index_lock:
+            queued = (index, folder) in self.index_waiting
+            if done is not None or not queued:
+                self.index_waiting[(index, folder)] = (generation, done)
+        if not queued:
+            self.index_jobs.put((index, folder))
+
+    def index_folders(self):
+        # Runs in a worker thread for the lifetime of the app, updating the
+        # indexes one folder at a time
+        while True:
+            index, folder = self.index_jobs.get()
+            with self.index_lock:
+                generation, done = self.index_waiting.pop((index, folder))
+            try:
+                changed = index.update(folder)
+            except Exception:
+                changed = False
+            if done is not None:
+                self.listing_queue.put((generation, "indexed", (done, changed)))
+
+    def cancel_search(self):
+        if self.search_progress is None:
+            return
+        scanned, matches = self.search_progress
+        self.cancel_listing()
+        self.status_var.set(
+            f"Search cancelled: scanned {scanned} dirs / {matches} matches"
+        )
 
     def sort_treeview(self, column):
         # Toggle sort order if clicking the same column
@@ -458,62 +4015,73 @@ class FileManagerApp:
             self.current_sort["column"] = column
             self.current_sort["reverse"] = False
 
-        self.view_contents()
+        # Rows still to come from a listing arrive in listing_sort order and
+        # are re-sorted once it is complete; a search's are sorted when it
+        # ends if a sort has been picked
+        if self.listing_sort is None:
+            self.listing_sort = dict(self.current_sort)
+        self.apply_sort()
 
         # Update column header to show sort direction
-        for col in ["Name", "Type", "Size", "Modified"]:
+        for col in COLUMNS + (MATCH_COLUMN,):
             if col == column:
                 direction = " ↓" if self.current_sort["reverse"] else " ↑"
                 self.result_tree.heading(col, text=f"{col}{direction}")
             else:
                 self.result_tree.heading(col, text=col)
 
-    def on_tree_select(self, event):
-        selected = self.result_tree.selection()
-        if not selected:
-            return
+    def apply_sort(self):
+        # Reorders the rows already in memory; the "..." row stays on top
+        store = self.row_store
+        order = self.file_view.rows
+        pinned = 1 if order and store.kinds[order[0]] == KIND_PARENT else 0
+        self.file_view.reorder(
+            order[:pinned]
+            + store.sorted(
+                order[pinned:],
+                self.current_sort["column"],
+                self.current_sort["reverse"],
+            )
+        )
 
-        # Get the selected item
-        item = self.result_tree.item(selected[0])["values"]
-        if not item:
+    def on_tree_select(self):
+        # Rows of self.row_store, in display order
+        selected = [self.file_view.rows[i] for i in self.file_view.selected_indices()]
+        if not selected:
             return
 
         # Handle "..." entry to go back to the previous folder
-        if item[0] == "...":
+        if self.row_store.kinds[selected[0]] == KIND_PARENT:
             self.set_target_folder(os.path.dirname(self.target_folder))
             return
 
         # Store all selected items
-        self.selected_items = []
-        for item_id in selected:
-            item_values = self.result_tree.item(item_id)["values"]
-            if item_values:
-                self.selected_items.append(item_values[0])  # Store filename
+        self.selected_items = [self.row_store.names[index] for index in selected]
 
         # If there's exactly one item selected, preview it
         if len(selected) == 1:
             self.preview_selected(selected[0])
+            self.root.after_idle(self.prefetch_neighbours)
 
         # Update status bar
         if len(selected) > 1:
             self.status_var.set(f"{len(selected)} items selected")
         elif len(selected) == 1:
-            item = self.result_tree.item(selected[0])["values"][0]
-            self.status_var.set(f"Selected: {item}")
-
-    def preview_selected(self, selected_id):
-        item = self.result_tree.item(selected_id)["values"]
-        if not item:
-            return
+            self.status_var.set(f"Selected: {self.selected_items[0]}")
 
-        name = item[0]
+    def preview_selected(self, index):
+        name = self.row_store.names[index]
         file_path = os.path.join(self.target_folder, name)
 
         # Hide both preview widgets
         self.preview_text.pack_forget()
         self.image_label.pack_forget()
+        self.close_text_window()
+        self.show_passage_list(None)
+        self.preview_kind = None
 
         if os.path.isdir(file_path):
+            self.preview_loader.cancel()
             self.preview_text.pack(fill=tk.BOTH, expand=True)
             self.preview_text.delete(1.0, tk.END)
             self.preview_text.insert(tk.END, f"{name} (Folder)\n\n")
@@ -531,142 +4099,286 @@ class FileManagerApp:
                 self.preview_text.insert(tk.END, f"Error reading folder contents: {e}")
             return
 
-        # Determine file type for preview
-        _, ext = os.path.splitext(name)
-        ext = ext.lower()
+        box = self.preview_box()
+        try:
+            st = os.stat(file_path)
+            key = (file_path, st.st_size, st.st_mtime_ns)
+        except OSError:
+            key = None
+        preview = self.preview_cache.get(key) if key else None
+        if preview is not None and preview_fits(preview, box):
+            self.preview_loader.cancel()
+            self.show_preview(index, preview)
+            return
 
-        # Text files
-        if ext in [
-            ".txt",
-            ".md",
-            ".py",
-            ".java",
-            ".html",
-            ".css",
-            ".js",
-            ".json",
-            ".xml",
-            ".csv",
-        ]:
-            self.preview_text.delete(1.0, tk.END)  # Clear the preview text
+        self.preview_text.pack(fill=tk.BOTH, expand=True)
+        self.preview_text.delete(1.0, tk.END)
+        self.preview_text.insert(tk.END, f"Loading preview of {name}...")
+        self.preview_serial = self.preview_loader.submit(
+            key, file_path, box, (self.row_store, index)
+        )
+        if not self.preview_polling:
+            self.preview_polling = True
+            self.root.after(PREVIEW_POLL_MS, self.poll_preview)
+
+    def prefetch_neighbours(self):
+        # The rows around the focused one are likely to be previewed next:
+        # nearest first, the row below before the row above
+        position = self.file_view.focus
+        if position is None:
+            return
+        rows = self.file_view.rows
+        store = self.row_store
+        paths = []
+        for distance in range(1, PREVIEW_PREFETCH_ROWS + 1):
+            for neighbour in (position + distance, position - distance):
+                if not 0 <= neighbour < len(rows):
+                    continue
+                index = rows[neighbour]
+                name = store.names[index]
+                if (
+                    store.kinds[index] == KIND_FILE
+                    and os.path.splitext(name)[1].lower() in PREVIEW_EXTENSIONS
+                ):
+                    paths.append(os.path.join(self.target_folder, name))
+        self.preview_loader.prefetch(paths, self.preview_box())
+
+    def poll_preview(self):
+        # Shows the result of the latest preview request; results of
+        # selections the user has since moved past are dropped
+        while True:
             try:
-                with open(file_path, "r", encoding="utf-8", errors="replace") as f:
-                    content = f.read(50000)  # Limit to 50K to avoid performance issues
+                serial, (store, index), preview = (
+                    self.preview_loader.results.get_nowait()
+                )
+            except queue.Empty:
+                break
+            if self.preview_loader.is_latest(serial):
+                self.preview_polling = False
+                # The list may have been replaced meanwhile
+                self.show_preview(index if store is self.row_store else None, preview)
+                return
+        if not self.preview_loader.is_latest(self.preview_serial):
+            # Cancelled: a cached preview or a folder was shown instead
+            self.preview_polling = False
+            return
+        self.root.after(PREVIEW_POLL_MS, self.poll_preview)
+
+    def preview_box(self):
+        # Size to fit the preview pane
+        preview_width = self.preview_frame.winfo_width() - 20
+        preview_height = self.preview_frame.winfo_height() - 20
+
+        # If the preview frame hasn't been rendered yet, use default values
+        if preview_width < 100:
+            preview_width = 400
+        if preview_height < 100:
+            preview_height = 600
+        return (preview_width, preview_height)
+
+    def show_preview(self, index, preview):
+        kind, data = preview
+        self.close_text_window()
+        self.show_passage_list(None)
+        self.preview_kind = kind
+        self.docx_preview = None
 
-                    # Count numbered passages
-                    count = self.count_numbered_passages(content)
-                    print(f"Numbered Passages Count: {count}")
+        # Text files
+        if kind == "text":
+            content, passages, rest = data
+            self.preview_text.pack(fill=tk.BOTH, expand=True)
+            self.preview_text.delete(1.0, tk.END)  # Clear the preview text
 
-                    # Insert the count at the top
-                    self.preview_text.insert(
-                        1.0, f"[Numbered Passages Count: {count}]\n\n"
+            if rest is not None:
+                # Too big to scan here: the passages come from the index if
+                # the file has been counted, and the file is paged through
+                # from where content stops
+                passages = self.indexed_passages(rest[0])
+                if passages is not None:
+                    count = len(passages)
+                elif index is not None and self.row_store.counts[index] >= 0:
+                    count = self.row_store.counts[index]
+                else:
+                    count = PENDING_COUNT
+                header = f"[Numbered Passages Count: {count}]\n\n"
+                try:
+                    self.text_window = TextWindow(
+                        self.preview_text, rest[0], header, content, rest[1]
                     )
+                except (OSError, ValueError) as e:
+                    self.preview_text.insert(tk.END, f"Error reading file: {e}")
+                    return
+                self.show_passage_list(
+                    passages, self.text_window.line_text, self.text_window.load_at
+                )
+                return
 
-                    # Insert the content below the count
-                    self.preview_text.insert(tk.END, content)
+            count = len(passages)
 
-                    if len(content) == 50000:
-                        self.preview_text.insert(
-                            tk.END, "\n\n[Content truncated - file too large]"
-                        )
+            # Insert the count at the top
+            self.preview_text.insert(1.0, f"[Numbered Passages Count: {count}]\n\n")
 
-                    # Update the Treeview with the correct count
-                    self.result_tree.item(
-                        selected_id,
-                        values=(
-                            item[0],  # Name
-                            item[1],  # Type
-                            item[2],  # Size
-                            item[3],  # Modified
-                            count,  # Numbered Passages
-                        ),
-                    )
+            # Insert the content below the count
+            self.preview_text.insert(tk.END, content)
+            self.show_passage_list(
+                passages,
+                lambda offset: line_around(content, offset),
+                # Below the two-line count header
+                lambda offset: self.preview_text.yview(f"3.0 + {offset} chars"),
+            )
 
-            except Exception as e:
-                self.preview_text.insert(tk.END, f"Error reading file: {e}")
+            # Update the Treeview with the correct count
+            if index is not None:
+                self.row_store.set_count(index, count)
+                self.file_view.refresh()
 
         # Word documents
-        elif ext == ".docx":
+        elif kind == "docx":
+            content, passages, rest = data
+            count = len(passages)
+            if rest is not None:
+                # Cut short: the passages come from the index if the
+                # document has been counted (its offsets are into the same
+                # text), and the row's own count covers the whole document
+                indexed = self.indexed_passages(rest)
+                if indexed is not None:
+                    passages = indexed
+                    count = len(passages)
+                elif index is not None and self.row_store.counts[index] >= 0:
+                    count = self.row_store.counts[index]
             self.preview_text.pack(fill=tk.BOTH, expand=True)
-            self.preview_text.delete(1.0, tk.END)
-            try:
-                doc = Document(file_path)
-                content = "\n\n".join([para.text for para in doc.paragraphs])
-                self.preview_text.insert(
-                    tk.END, content if content.strip() else "[Empty document]"
-                )
-
-                # Count numbered passages and display the count
-                count = self.count_numbered_passages(content)
-                self.preview_text.insert(
-                    tk.END, f"\n\n[Numbered Passages Count: {count}]"
-                )
+            self.show_docx(content, rest, count)
+            self.show_passage_list(passages, self.docx_line, self.docx_jump)
 
-                # Update the Treeview with the correct count
-                self.result_tree.item(
-                    selected_id,
-                    values=(
-                        item[0],  # Name
-                        item[1],  # Type
-                        item[2],  # Size
-                        item[3],  # Modified
-                        count,  # Numbered Passages
-                    ),
-                )
-
-            except Exception as e:
-                self.preview_text.insert(tk.END, f"Error reading .docx file:\n{e}")
+            # Update the Treeview with the correct count
+            if index is not None and rest is None:
+                self.row_store.set_count(index, count)
+                self.file_view.refresh()
 
         # Images
-        elif ext in [".jpg", ".jpeg", ".png", ".gif", ".bmp"]:
-            try:
-                # Show image preview
-                img = Image.open(file_path)
-
-                # Resize to fit the preview pane
-                preview_width = self.preview_frame.winfo_width() - 20
-                preview_height = self.preview_frame.winfo_height() - 20
-
-                # If the preview frame hasn't been rendered yet, use default values
-                if preview_width < 100:
-                    preview_width = 400
-                if preview_height < 100:
-                    preview_height = 600
-
-                img.thumbnail((preview_width, preview_height))
-                photo = ImageTk.PhotoImage(img)
-
-                self.image_label.configure(image=photo)
-                self.image_label.image = (
-                    photo  # Keep a reference to prevent garbage collection
-                )
-                self.image_label.pack(fill=tk.BOTH, expand=True)
+        elif kind == "image":
+            photo = ImageTk.PhotoImage(data[0])
+            self.image_label.configure(image=photo)
+            self.image_label.image = (
+                photo  # Keep a reference to prevent garbage collection
+            )
+            self.image_label.pack(fill=tk.BOTH, expand=True)
 
-            except Exception as e:
-                self.preview_text.pack(fill=tk.BOTH, expand=True)
-                self.preview_text.delete(1.0, tk.END)
-                self.preview_text.insert(tk.END, f"Error displaying image: {e}")
+        elif kind == "error":
+            self.preview_text.pack(fill=tk.BOTH, expand=True)
+            self.preview_text.delete(1.0, tk.END)
+            self.preview_text.insert(tk.END, data)
 
         else:
             # Unsupported file type
             self.preview_text.pack(fill=tk.BOTH, expand=True)
             self.preview_text.delete(1.0, tk.END)
-            self.preview_text.insert(tk.END, f"Preview not supported for {ext} files.")
+            self.preview_text.insert(tk.END, f"Preview not supported for {data} files.")
 
-    def count_numbered_passages(self, text):
-        pattern = r"(?m)^\s*\d+[.,]"  # Start of line, digits, then . or ,
-        return len(re.findall(pattern, text))
+    def show_docx(self, content, rest, count):
+        self.docx_preview = (content, rest, count)
+        self.preview_text.delete(1.0, tk.END)
+        self.preview_text.insert(
+            tk.END, content if content.strip() else "[Empty document]"
+        )
+        if rest is not None:
+            self.preview_text.insert(
+                tk.END, "\n\n[Content truncated - document too large]"
+            )
+        self.preview_text.insert(tk.END, f"\n\n[Numbered Passages Count: {count}]")
+
+    def docx_line(self, offset):
+        content = self.docx_preview[0]
+        if offset >= len(content):
+            return "(past the preview, loaded when picked)"
+        return line_around(content, offset)
+
+    def docx_jump(self, offset):
+        # A passage past the text shown has the document read up to it and
+        # PREVIEW_TEXT_LIMIT characters beyond
+        content, rest, count = self.docx_preview
+        if rest is not None and offset >= len(content):
+            try:
+                content, truncated = read_docx_preview(
+                    rest, offset + PREVIEW_TEXT_LIMIT
+                )
+            except Exception as e:
+                self.status_var.set(f"Error reading .docx file: {e}")
+                return
+            self.show_docx(content, rest if truncated else None, count)
+        self.preview_text.yview(f"1.0 + {offset} chars")
 
-    def open_selected(self):
-        selected = self.result_tree.focus()
-        if not selected:
+    def indexed_passages(self, file_path):
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return None
+        return self.passage_index.get_offsets(file_path, st.st_size, st.st_mtime_ns)
+
+    def show_passage_list(self, passages, label=None, jump=None):
+        # Fills the jump list with the passages at the given offsets;
+        # label(offset) is the text of the passage's line and jump(offset)
+        # scrolls the preview to it. None empties the list.
+        self.passage_offsets = passages if passages is not None else array.array("q")
+        self.passage_jump = jump
+        values = [
+            f"{number}: {label(offset)}"
+            for number, offset in enumerate(
+                self.passage_offsets[:PASSAGE_LIST_LIMIT], 1
+            )
+        ]
+        self.passage_list.configure(
+            values=values, state="normal" if self.passage_offsets else "disabled"
+        )
+        self.passage_var.set("")
+
+    def jump_to_passage(self):
+        # Takes the passage number from a list entry or from what was typed
+        match = re.match(r"\s*(\d+)", self.passage_var.get())
+        if not match or self.passage_jump is None:
             return
+        number = int(match.group(1))
+        if not 1 <= number <= len(self.passage_offsets):
+            if self.docx_preview is not None and self.docx_preview[1] is not None:
+                # Only the passages in the text shown are known until the
+                # document has been counted
+                self.status_var.set(
+                    f"Passage {number} isn't in the preview; it can be picked "
+                    "once the document has been counted"
+                )
+            else:
+                self.status_var.set(f"There is no passage {number}")
+            return
+        self.passage_jump(self.passage_offsets[number - 1])
+        self.status_var.set(f"Passage {number} of {len(self.passage_offsets)}")
+
+    def close_text_window(self):
+        if self.text_window is not None:
+            self.text_window.close()
+            self.text_window = None
+
+    def goto_preview_line(self):
+        if self.preview_kind != "text":
+            return "break"
+        line = simpledialog.askinteger(
+            "Go to Line", "Line number:", minvalue=1, parent=self.root
+        )
+        if line is None:
+            return "break"
+        if self.text_window is not None:
+            if not self.text_window.goto_line(line):
+                self.status_var.set(f"The file has fewer than {line} lines")
+        else:
+            # Below the two-line count header
+            self.preview_text.yview(f"{line + 2}.0")
+        return "break"
 
-        item = self.result_tree.item(selected)["values"]
-        if not item:
+    def open_selected(self):
+        selected = self.file_view.focus
+        if selected is None:
             return
 
-        name = item[0]
+        name = self.row_store.names[self.file_view.rows[selected]]
         file_path = os.path.join(self.target_folder, name)
 
         if os.path.isdir(file_path):
@@ -692,6 +4404,7 @@ class FileManagerApp:
         if not files:
             return
 
+        added = []
         for file_path in files:
             try:
                 file_name = os.path.basename(file_path)
@@ -704,9 +4417,10 @@ class FileManagerApp:
                     counter += 1
 
                 shutil.copy2(file_path, dest_path)
+                added.append(file_name)
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to copy {file_path}:\n{e}")
-        self.view_contents()
+        self.refresh_entries(added)
 
     def add_folder(self):
         if not self.target_folder:
@@ -730,7 +4444,7 @@ class FileManagerApp:
             shutil.copytree(folder_path, dest_path)
         except Exception as e:
             messagebox.showerror("Error", f"Failed to copy folder:\n{e}")
-        self.view_contents()
+        self.refresh_entries([os.path.basename(dest_path)])
 
     def create_subfolder(self):
         if not self.target_folder:
@@ -748,7 +4462,7 @@ class FileManagerApp:
 
         try:
             os.mkdir(new_folder_path)
-            self.view_contents()
+            self.refresh_entries([subfolder_name])
         except Exception as e:
             messagebox.showerror("Error", f"Could not create folder:\n{e}")
 
@@ -773,7 +4487,7 @@ class FileManagerApp:
 
         try:
             os.rename(old_path, new_path)
-            self.view_contents()
+            self.refresh_entries([old_name, new_name])
             self.status_var.set(f"Renamed '{old_name}' to '{new_name}'")
         except Exception as e:
             messagebox.showerror("Error", f"Failed to rename: {e}")
@@ -804,7 +4518,7 @@ class FileManagerApp:
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to delete '{name}': {e}")
 
-        self.view_contents()
+        self.refresh_entries(self.selected_items)
         self.status_var.set(f"Deleted {deleted} of {count} items")
 
     def move_selected(self):
@@ -840,7 +4554,7 @@ class FileManagerApp:
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to move '{name}': {e}")
 
-        self.view_contents()
+        self.refresh_entries(self.selected_items)
         count = len(self.selected_items)
         self.status_var.set(
             f"Moved {moved} of {count} items to {os.path.basename(dest_folder)}"
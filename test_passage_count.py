@@ -0,0 +1,55 @@
+import random
+
+from smart_manager import (
+    count_numbered_passages,
+    count_numbered_passages_mmap,
+    count_numbered_passages_stream,
+)
+
+# Pieces that exercise both the ASCII fast path and the decoded fallback:
+# Bengali digits, no-break and other Unicode spaces, and invalid UTF-8
+PIECES = [
+    b"1.",
+    b"12,",
+    b"3",
+    b".",
+    b",",
+    b" ",
+    b"\t",
+    b"\n",
+    b"\r\n",
+    b"\x1c",
+    b"abc",
+    "১.".encode(),  # Bengali digit one
+    "২৩,".encode(),
+    " ".encode(),  # no-break space
+    " ".encode(),  # em space
+    "é".encode(),
+    b"\xff",
+    b"\xc3",
+    b"\x80",
+]
+
+
+def random_text(rng):
+    return b"".join(rng.choice(PIECES) for _ in range(rng.randint(0, 40)))
+
+
+def test_mmap_count_matches_regex_count(tmp_path):
+    rng = random.Random(5)
+    path = tmp_path / "passages.txt"
+    for _ in range(3000):
+        data = random_text(rng)
+        path.write_bytes(data)
+        expected = count_numbered_passages(data.decode("utf-8", "ignore"))
+        assert count_numbered_passages_mmap(str(path)) == expected, data
+
+
+def test_stream_count_matches_regex_count():
+    rng = random.Random(6)
+    for _ in range(3000):
+        text = random_text(rng).decode("utf-8", "ignore")
+        size = rng.randint(1, 8)
+        chunks = [text[i : i + size] for i in range(0, len(text), size)]
+        expected = count_numbered_passages(text)
+        assert count_numbered_passages_stream(chunks) == expected, text